@@ -0,0 +1,258 @@
+'''
+模块作用：SORT追踪器的离线基准测试
+生成可控目标数量、运动速度和遮挡程度的合成检测序列，用不同参数和实现运行Sort，
+报告每帧耗时分位数、峰值内存，以及相对合成真值的MOTA和IDF1，
+每次修改追踪器后都可以同时检查速度和正确性有没有退化
+
+用法示例：
+    python bench_sort.py --objects 100 1000 --spatial_index both
+    python bench_sort.py --impl sort:Sort old_sort:Sort --objects 500 --occlusion 0.05
+
+'''
+import argparse
+import importlib
+import inspect
+import json
+import time
+import tracemalloc
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from sort import iou_batch
+
+
+def generate_sequence(num_objects=100, num_frames=300, width=3840, height=2160, speed=4.,
+                      box_size=(20, 80), noise=1.5, miss_rate=0.02, occlusion=0.01,
+                      occlusion_length=(5, 20), false_positives=0.02, seed=0):
+    """
+    生成合成检测序列和对应的真值
+
+    目标做带随机扰动的匀速运动，碰到画面边缘反弹；每个目标每帧以occlusion的概率开始一段
+    持续occlusion_length帧的遮挡，遮挡期间没有检测；此外每个检测以miss_rate的概率漏检，
+    并按num_objects * false_positives的期望数量加入随机误检
+
+    参数:
+        num_objects: 同时存在的目标数
+        num_frames: 帧数
+        width, height: 画面尺寸
+        speed: 目标平均速度(像素/帧)
+        box_size: 目标框边长范围
+        noise: 检测框坐标的高斯噪声标准差
+        miss_rate: 单帧随机漏检率
+        occlusion: 每帧开始一段遮挡的概率
+        occlusion_length: 遮挡持续帧数范围
+        false_positives: 每帧误检数相对目标数的比例
+        seed: 随机种子
+
+    返回:
+        tuple: (检测列表, 真值列表)，每帧一项；检测为(N,5)数组[x1,y1,x2,y2,score]，
+            真值为(ids, boxes)，boxes为(M,4)数组
+    """
+    rng = np.random.default_rng(seed)
+    size = rng.uniform(box_size[0], box_size[1], (num_objects, 2))
+    pos = rng.uniform(0, 1, (num_objects, 2)) * ([width, height] - size)
+    angle = rng.uniform(0, 2 * np.pi, num_objects)
+    vel = np.stack((np.cos(angle), np.sin(angle)), axis=1) * rng.uniform(0.5, 1.5, (num_objects, 1)) * speed
+    occluded_until = np.zeros(num_objects, dtype=int)
+    ids = np.arange(num_objects)
+
+    detections, ground_truth = [], []
+    for frame in range(num_frames):
+        vel += rng.normal(0, 0.05 * speed, vel.shape)
+        pos += vel
+        # 碰到画面边缘反弹
+        low = pos < 0
+        high = pos > [width, height] - size
+        vel[low | high] *= -1
+        pos = np.clip(pos, 0, [width, height] - size)
+        boxes = np.concatenate((pos, pos + size), axis=1)
+        ground_truth.append((ids, boxes))
+
+        start = (occluded_until <= frame) & (rng.random(num_objects) < occlusion)
+        occluded_until[start] = frame + rng.integers(occlusion_length[0], occlusion_length[1] + 1, start.sum())
+        visible = (occluded_until <= frame) & (rng.random(num_objects) >= miss_rate)
+        dets = boxes[visible] + rng.normal(0, noise, (visible.sum(), 4))
+
+        num_fp = rng.poisson(num_objects * false_positives)
+        fp_size = rng.uniform(box_size[0], box_size[1], (num_fp, 2))
+        fp_pos = rng.uniform(0, 1, (num_fp, 2)) * ([width, height] - fp_size)
+        dets = np.concatenate((dets, np.concatenate((fp_pos, fp_pos + fp_size), axis=1)))
+        scores = rng.uniform(0.5, 1., (len(dets), 1))
+        detections.append(np.concatenate((dets, scores), axis=1))
+    return detections, ground_truth
+
+
+def evaluate(ground_truth, hypotheses, iou_threshold=0.5):
+    """
+    计算CLEAR MOT的MOTA和IDF1
+
+    参数:
+        ground_truth: 每帧的(ids, boxes)
+        hypotheses: 每帧的追踪输出(ids, boxes)
+        iou_threshold: 真值与追踪框算作匹配的最小IoU
+
+    返回:
+        dict: mota, idf1以及fp, fn, id_switches等计数
+    """
+    fp = fn = id_switches = num_gt = num_hyp = 0
+    last_match = {}  # 真值ID -> 上一次匹配到的追踪ID
+    # 每对(真值ID, 追踪ID)框重叠的帧数，用于IDF1的全局轨迹匹配
+    overlap_frames = {}
+    for (gt_ids, gt_boxes), (hyp_ids, hyp_boxes) in zip(ground_truth, hypotheses):
+        num_gt += len(gt_ids)
+        num_hyp += len(hyp_ids)
+        if len(gt_ids) == 0 or len(hyp_ids) == 0:
+            fn += len(gt_ids)
+            fp += len(hyp_ids)
+            continue
+        iou = iou_batch(gt_boxes, hyp_boxes)
+        valid = iou >= iou_threshold
+        for g, h in zip(*np.nonzero(valid)):
+            key = (gt_ids[g], hyp_ids[h])
+            overlap_frames[key] = overlap_frames.get(key, 0) + 1
+
+        # 上一帧的匹配仍然有效时优先保留，其余按IoU做最优匹配
+        cost = np.where(valid, 1. - iou, np.inf)
+        hyp_pos = {hyp_id: j for j, hyp_id in enumerate(hyp_ids)}
+        for i, gt_id in enumerate(gt_ids):
+            j = hyp_pos.get(last_match.get(gt_id))
+            if j is not None and valid[i, j]:
+                cost[i, j] = -1.
+        finite = np.where(np.isfinite(cost), cost, 1e6)
+        rows, cols = linear_sum_assignment(finite)
+        keep = np.isfinite(cost[rows, cols])
+        rows, cols = rows[keep], cols[keep]
+        for i, j in zip(rows, cols):
+            gt_id, hyp_id = gt_ids[i], hyp_ids[j]
+            if gt_id in last_match and last_match[gt_id] != hyp_id:
+                id_switches += 1
+            last_match[gt_id] = hyp_id
+        fn += len(gt_ids) - len(rows)
+        fp += len(hyp_ids) - len(rows)
+
+    idtp = 0
+    if overlap_frames:
+        gt_index = {g: i for i, g in enumerate({g for g, _ in overlap_frames})}
+        hyp_index = {h: j for j, h in enumerate({h for _, h in overlap_frames})}
+        counts = np.zeros((len(gt_index), len(hyp_index)))
+        for (g, h), n in overlap_frames.items():
+            counts[gt_index[g], hyp_index[h]] = n
+        rows, cols = linear_sum_assignment(-counts)
+        idtp = counts[rows, cols].sum()
+    return {
+        "mota": 1. - (fn + fp + id_switches) / max(num_gt, 1),
+        "idf1": 2. * idtp / max(num_gt + num_hyp, 1),
+        "fp": fp,
+        "fn": fn,
+        "id_switches": id_switches,
+    }
+
+
+def load_impl(spec):
+    """按"模块:类名"加载追踪器实现，例如"sort:Sort"或指向旧版本副本的"old_sort:Sort\""""
+    module_name, class_name = spec.split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def run_tracker(tracker_cls, detections, params, measure_memory=False):
+    """
+    逐帧运行追踪器
+
+    返回:
+        tuple: (每帧耗时数组(秒), 每帧输出的(ids, boxes), 峰值内存(字节)，未测量时为None)
+    """
+    tracker = tracker_cls(**params)
+    latencies = np.empty(len(detections))
+    outputs = []
+    if measure_memory:
+        tracemalloc.start()
+    for frame, dets in enumerate(detections):
+        start = time.perf_counter()
+        tracks = tracker.update(dets)
+        latencies[frame] = time.perf_counter() - start
+        outputs.append((tracks[:, 4].astype(int), tracks[:, :4]))
+    peak = None
+    if measure_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return latencies, outputs, peak
+
+
+def benchmark(impl, detections, ground_truth, params, warmup=10):
+    """
+    对一种实现和参数组合做一次完整测试：先不开tracemalloc测耗时和精度，再单独跑一遍测峰值内存
+    （tracemalloc会显著拖慢numpy之外的Python代码，不能和计时放在同一遍）
+    """
+    tracker_cls = load_impl(impl)
+    # 旧版本的实现没有spatial_index等新参数，只传入它接受的参数
+    accepted = inspect.signature(tracker_cls).parameters
+    params = {k: v for k, v in params.items() if k in accepted}
+    latencies, outputs, _ = run_tracker(tracker_cls, detections, params)
+    _, _, peak = run_tracker(tracker_cls, detections, params, measure_memory=True)
+    measured = latencies[warmup:] if len(latencies) > warmup else latencies
+    result = {
+        "impl": impl,
+        "params": params,
+        "objects": len(ground_truth[0][0]),
+        "frames": len(detections),
+        "fps": len(measured) / measured.sum(),
+        "p50_ms": np.percentile(measured, 50) * 1000,
+        "p90_ms": np.percentile(measured, 90) * 1000,
+        "p99_ms": np.percentile(measured, 99) * 1000,
+        "max_ms": measured.max() * 1000,
+        "peak_mem_mb": peak / 2 ** 20,
+    }
+    result.update(evaluate(ground_truth, outputs))
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='SORT offline benchmark')
+    parser.add_argument("--impl", nargs="+", default=["sort:Sort"],
+                        help="追踪器实现，格式为 模块:类名，可以给出多个进行对比")
+    parser.add_argument("--objects", type=int, nargs="+", default=[100, 500], help="同时存在的目标数")
+    parser.add_argument("--frames", type=int, default=300, help="每个序列的帧数")
+    parser.add_argument("--speed", type=float, default=4., help="目标平均速度(像素/帧)")
+    parser.add_argument("--occlusion", type=float, default=0.01, help="每帧开始一段遮挡的概率")
+    parser.add_argument("--miss_rate", type=float, default=0.02, help="单帧随机漏检率")
+    parser.add_argument("--false_positives", type=float, default=0.02, help="每帧误检数相对目标数的比例")
+    parser.add_argument("--max_age", type=int, nargs="+", default=[1])
+    parser.add_argument("--min_hits", type=int, nargs="+", default=[3])
+    parser.add_argument("--iou_threshold", type=float, nargs="+", default=[0.3])
+    parser.add_argument("--spatial_index", choices=["off", "on", "both"], default="off",
+                        help="是否启用SORT的网格空间索引，both为两种都测")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="把结果写入JSON文件，便于和之前的结果对比")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    # 默认不传spatial_index，只有on/both时才加入参数组合
+    spatial = {"off": [{}], "on": [{"spatial_index": True}],
+               "both": [{"spatial_index": False}, {"spatial_index": True}]}[args.spatial_index]
+    param_grid = [
+        dict({"max_age": max_age, "min_hits": min_hits, "iou_threshold": iou_threshold}, **s)
+        for max_age in args.max_age for min_hits in args.min_hits
+        for iou_threshold in args.iou_threshold for s in spatial
+    ]
+    results = []
+    header = "%-12s %-58s %7s %8s %8s %8s %8s %9s %7s %7s %5s" % (
+        "impl", "params", "objects", "fps", "p50 ms", "p99 ms", "max ms", "peak MB", "MOTA", "IDF1", "IDSW")
+    print(header)
+    for num_objects in args.objects:
+        detections, ground_truth = generate_sequence(
+            num_objects, args.frames, speed=args.speed, miss_rate=args.miss_rate,
+            occlusion=args.occlusion, false_positives=args.false_positives, seed=args.seed)
+        for impl in args.impl:
+            for params in param_grid:
+                r = benchmark(impl, detections, ground_truth, params)
+                results.append(r)
+                params_str = ",".join("%s=%s" % (k, v) for k, v in r["params"].items())
+                print("%-12s %-58s %7d %8.1f %8.2f %8.2f %8.2f %9.1f %7.3f %7.3f %5d" % (
+                    impl, params_str, r["objects"], r["fps"], r["p50_ms"], r["p99_ms"], r["max_ms"],
+                    r["peak_mem_mb"], r["mota"], r["idf1"], r["id_switches"]))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, default=float)
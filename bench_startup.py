@@ -0,0 +1,70 @@
+'''
+模块作用：模块导入耗时和内存的基准测试
+每个模块在新的Python进程中导入若干次，报告导入耗时中位数和进程峰值内存(RSS)，
+用于检查sort.py、client.py等边缘进程入口没有重新引入重量级的导入（matplotlib、torch、re-ID模型等）
+
+用法示例：
+    python bench_startup.py
+    python bench_startup.py --modules sort client --repeat 10 --budget 0.5
+
+'''
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# 子进程中执行：只计import语句本身的耗时，峰值内存单位在Linux上为KB
+CHILD = (
+    "import json, resource, time\n"
+    "start = time.perf_counter()\n"
+    "import {module}\n"
+    "elapsed = time.perf_counter() - start\n"
+    "print(json.dumps({{'seconds': elapsed, 'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}}))\n"
+)
+
+
+def measure(module, repeat):
+    """
+    返回:
+        dict: {"seconds": 导入耗时中位数, "rss_mb": 峰值内存中位数}；导入失败时为{"error": 错误信息}
+    """
+    seconds = []
+    rss = []
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-c", CHILD.format(module=module)], capture_output=True, text=True)
+        if proc.returncode != 0:
+            return {"error": proc.stderr.strip().splitlines()[-1]}
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        seconds.append(result["seconds"])
+        rss.append(result["rss_kb"] / 1024.)
+    return {"seconds": statistics.median(seconds), "rss_mb": statistics.median(rss)}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Import time benchmark')
+    parser.add_argument("--modules", nargs="+", default=["sort", "client", "track", "metrics", "outbox", "capture"],
+                        help="要测试的模块")
+    parser.add_argument("--repeat", type=int, default=5, help="每个模块的导入次数")
+    parser.add_argument("--budget", type=float, default=None,
+                        help="导入耗时上限(秒)，任一模块超出时以非零状态退出")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    baseline = measure("sys", args.repeat)
+    print("%-10s %10s %10s" % ("module", "import ms", "RSS MB"))
+    print("%-10s %10.1f %10.1f" % ("(python)", baseline["seconds"] * 1000, baseline["rss_mb"]))
+    over_budget = []
+    for module in args.modules:
+        result = measure(module, args.repeat)
+        if "error" in result:
+            print("%-10s %s" % (module, result["error"]))
+            continue
+        print("%-10s %10.1f %10.1f" % (module, result["seconds"] * 1000, result["rss_mb"]))
+        if args.budget is not None and result["seconds"] > args.budget:
+            over_budget.append(module)
+    if over_budget:
+        print("Over budget (%.2fs): %s" % (args.budget, ", ".join(over_budget)))
+        sys.exit(1)
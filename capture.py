@@ -0,0 +1,134 @@
+'''
+模块作用：实时视频源（RTSP/HTTP摄像头、本地摄像头）的低延迟读帧
+专用线程持续解码，帧写入固定大小的环形缓冲区，缓冲区满时覆盖最旧的帧；
+read()总是返回最新的一帧，跳过未读的旧帧并计入dropped，推理慢于摄像头时延迟不会累积。
+解码线程和推理并行；视频流超过stall_timeout秒没有新帧（FFmpeg读超时）或读帧失败时自动重连。
+接口与cv2.VideoCapture的read()/isOpened()/release()一致，可以直接替换
+
+'''
+import threading
+from collections import deque
+
+import cv2
+
+import metrics
+
+
+def is_live_source(source):
+    """摄像头编号和网络流视为实时视频源，本地视频文件不是"""
+    if isinstance(source, int):
+        return True
+    return isinstance(source, str) and source.split("://", 1)[0].lower() in ("rtsp", "rtmp", "http", "https", "udp")
+
+
+class LiveCapture:
+    def __init__(self, source, buffer_size=4, stall_timeout=5., reconnect_delay=1., max_reconnect_delay=30.):
+        """
+        参数:
+            source: 视频源
+            buffer_size: 环形缓冲区能保存的帧数
+            stall_timeout: 超过该秒数没有新帧视为卡住，重新连接
+            reconnect_delay: 重连的初始等待时间(秒)，连续失败时加倍
+            max_reconnect_delay: 重连等待时间上限(秒)
+        """
+        self.source = source
+        self.stall_timeout = stall_timeout
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.buffer = deque(maxlen=buffer_size)
+        self.frame_ready = threading.Condition()
+        self.running = True
+        # 统计计数
+        self.decoded = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.cap = None
+        self.thread = threading.Thread(target=self._decode, name="capture", daemon=True)
+        self.thread.start()
+
+    def _open(self):
+        # 打开和读帧都设置超时，网络卡住时cap.read()返回失败而不是一直阻塞
+        timeout_ms = int(self.stall_timeout * 1000)
+        cap = cv2.VideoCapture(self.source, cv2.CAP_ANY, [
+            cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, timeout_ms,
+            cv2.CAP_PROP_READ_TIMEOUT_MSEC, timeout_ms,
+        ])
+        # 尽量不让OpenCV/FFmpeg自己再缓存帧
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
+    def _decode(self):
+        """解码线程：不断读帧写入环形缓冲区，失败时按退避间隔重连"""
+        delay = self.reconnect_delay
+        while self.running:
+            if self.cap is None or not self.cap.isOpened():
+                self.cap = self._open()
+                if not self.cap.isOpened():
+                    self._backoff(delay)
+                    delay = min(delay * 2, self.max_reconnect_delay)
+                    continue
+            ret, frame = self.cap.read()
+            if not ret:
+                self._reconnect()
+                self._backoff(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+            delay = self.reconnect_delay
+            with self.frame_ready:
+                if len(self.buffer) == self.buffer.maxlen:
+                    self.dropped += 1
+                    metrics.DROPPED.labels("capture").inc()
+                self.buffer.append(frame)
+                self.decoded += 1
+                self.frame_ready.notify_all()
+        if self.cap is not None:
+            self.cap.release()
+
+    def _backoff(self, delay):
+        """重连前等待delay秒，stop()时立即返回"""
+        with self.frame_ready:
+            self.frame_ready.wait_for(lambda: not self.running, delay)
+
+    def _reconnect(self):
+        cap, self.cap = self.cap, None
+        if cap is not None:
+            cap.release()
+        if self.running:
+            self.reconnects += 1
+            metrics.RECONNECTS.labels("capture").inc()
+
+    def read(self, timeout=None):
+        """
+        取最新的一帧，缓冲区中更早的未读帧被丢弃；没有新帧时等待
+
+        返回:
+            (ret, frame)，与cv2.VideoCapture.read()相同；已release()或等待超时时ret为False
+        """
+        with self.frame_ready:
+            if not self.frame_ready.wait_for(lambda: self.buffer or not self.running, timeout):
+                return False, None
+            if not self.buffer:
+                return False, None
+            frame = self.buffer.pop()
+            self.dropped += len(self.buffer)
+            if self.buffer:
+                metrics.DROPPED.labels("capture").inc(len(self.buffer))
+            self.buffer.clear()
+        return True, frame
+
+    def isOpened(self):
+        return self.running
+
+    def stop(self):
+        """停止读帧并唤醒等待中的read()，不等待解码线程退出"""
+        self.running = False
+        with self.frame_ready:
+            self.frame_ready.notify_all()
+
+    def release(self):
+        self.stop()
+        # 解码线程退出时自己释放连接，避免和正在进行的cap.read()并发
+        self.thread.join(timeout=self.stall_timeout * 2)
+
+    def stats(self):
+        return {"decoded": self.decoded, "dropped": self.dropped, "reconnects": self.reconnects}
@@ -3,15 +3,162 @@
 输入：轮询检测结果时间间隔，websocket服务器地址
 
 '''
-from collections import deque
+from collections import OrderedDict
 import asyncio
+import time
 from datetime import *
-import aioconsole
 import websockets
 import json
 import util
+from outbox import Outbox
+import metrics
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class DetectionQueue:
+    """
+    按目标ID去重的待发送队列
+
+    用OrderedDict按入队顺序保存检测结果，键为目标ID，成员判断为O(1)。
+    队列长度超过maxlen时按overflow策略处理最旧的一项：
+        "drop_oldest": 直接丢弃，计入dropped
+        "spill": 以JSON行追加写入spill_path，计入spilled；popleft时优先按顺序读回磁盘上的数据
+    已发送（出队）的ID不再参与去重，与原先只在队列内判重的行为一致。
+    """
+
+    def __init__(self, maxlen=None, overflow="drop_oldest", spill_path=None):
+        if overflow not in ("drop_oldest", "spill"):
+            raise ValueError(f"未知的队列溢出策略: {overflow}")
+        if overflow == "spill" and spill_path is None:
+            raise ValueError("spill策略需要指定spill_path")
+        self.maxlen = maxlen
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self._items = OrderedDict()
+        # 已写入磁盘、尚未读回的目标ID
+        self._spilled_ids = set()
+        self._spill_offset = 0
+        if spill_path is not None:
+            # 上次运行残留的数据没有对应的ID记录，直接清空
+            open(spill_path, 'w').close()
+        # 统计计数
+        self.dropped = 0
+        self.spilled = 0
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self._items) + len(self._spilled_ids)
+
+    def __contains__(self, obj_id):
+        return obj_id in self._items or obj_id in self._spilled_ids
+
+    def append(self, obj):
+        """按obj['id']入队，ID已在队列中时忽略并返回False"""
+        obj_id = obj['id']
+        if obj_id in self:
+            self.duplicates += 1
+            return False
+        self._items[obj_id] = obj
+        if self.maxlen is not None and len(self._items) > self.maxlen:
+            oldest_id, oldest = self._items.popitem(last=False)
+            if self.overflow == "spill":
+                self._spill(oldest_id, oldest)
+            else:
+                self.dropped += 1
+                metrics.DROPPED.labels("detection_queue").inc()
+        return True
+
+    def popleft(self):
+        """取出最早入队的一项，磁盘上的数据比内存中的更早"""
+        if self._spilled_ids:
+            return self._unspill()
+        if not self._items:
+            raise IndexError("pop from an empty DetectionQueue")
+        return self._items.popitem(last=False)[1]
+
+    def extendleft(self, objs):
+        """把发送失败的一批数据按原顺序放回队首，已在队列中的ID忽略"""
+        for obj in reversed(objs):
+            obj_id = obj['id']
+            if obj_id in self:
+                continue
+            self._items[obj_id] = obj
+            self._items.move_to_end(obj_id, last=False)
+
+    def _spill(self, obj_id, obj):
+        with open(self.spill_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(util.convert_numpy_types(obj)) + "\n")
+        self._spilled_ids.add(obj_id)
+        self.spilled += 1
+
+    def _unspill(self):
+        with open(self.spill_path, 'r', encoding='utf-8') as f:
+            f.seek(self._spill_offset)
+            line = f.readline()
+            self._spill_offset = f.tell()
+        obj = json.loads(line)
+        self._spilled_ids.discard(obj['id'])
+        # 磁盘数据全部读回后清空文件
+        if not self._spilled_ids:
+            open(self.spill_path, 'w').close()
+            self._spill_offset = 0
+        return obj
+
+    def stats(self):
+        return {
+            "queued": len(self),
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "duplicates": self.duplicates,
+        }
+
+
+class StreamChannel:
+    """
+    一路视频流的上传通道：各自的待发送队列或发件箱、seq和上传时使用的client_id，
+    多路视频流共用wsClient的一条websocket连接
+    """
+
+    def __init__(self, stream_id, client_id, detection_queue, outbox):
+        self.stream_id = stream_id
+        self.client_id = client_id
+        self.detection_queue = detection_queue
+        self.outbox = outbox
+        # 本次连接已发送的最后一个seq；重连后从已确认的位置重发
+        self.sent_seq = 0
+        # 最早一项未发送数据开始等待的时间，用于flush_interval计时
+        self.first_pending = None
+
+    def pending(self, limit):
+        """未发送的数据条数，最多数到limit"""
+        if self.outbox is not None:
+            return self.outbox.count_after(self.sent_seq, limit)
+        return len(self.detection_queue)
+
+
+def stream_path(path, stream_id, num_streams):
+    """把{stream_id}替换为视频流编号，得到每路视频流自己的文件路径"""
+    if path is None:
+        return None
+    if "{stream_id}" not in path and num_streams > 1:
+        raise ValueError(f"多路视频流时文件路径需要包含{{stream_id}}: {path}")
+    return path.format(stream_id=stream_id)
+
+
 class wsClient:
-    def __init__(self, _address, _id, detect_time, tracker):
+    def __init__(self, _address, _id, detect_time, tracker,
+                 queue_maxlen=None, queue_overflow="drop_oldest", spill_path=None,
+                 batch_max_items=64, batch_max_bytes=16384, flush_interval=0.5,
+                 encoding="json", compression="deflate", outbox_path=None, outbox_max_rows=None,
+                 streams=None):
+        """
+        streams为{视频流编号: 上传时使用的client_id}，默认只有视频流0并使用_id；
+        每路视频流有自己的队列或发件箱（spill_path和outbox_path中的{stream_id}替换为视频流编号），
+        所有视频流通过同一条websocket连接轮流上传
+        """
         self.address = _address
         self.client_id = _id
         self.shutdown_state = False
@@ -20,7 +167,32 @@ class wsClient:
         self.heartbeat = False
         self.detect_time = detect_time
         self.tracker = tracker
-        self.detection_queue = deque([])
+        # 批量上传：一帧websocket消息最多batch_max_items项或约batch_max_bytes字节，
+        # 攒不满时最早一项入批后flush_interval秒发送
+        if encoding == "msgpack" and msgpack is None:
+            raise ImportError("encoding='msgpack'需要安装msgpack")
+        self.batch_max_items = batch_max_items
+        self.batch_max_bytes = batch_max_bytes
+        self.flush_interval = flush_interval
+        self.encoding = encoding
+        # websocket的permessage-deflate压缩，None为关闭
+        self.compression = compression
+        self.data_ready = asyncio.Event()
+        if streams is None:
+            streams = {0: _id}
+        self.channels = []
+        for stream_id, stream_client_id in streams.items():
+            # 指定outbox_path时检测结果写入磁盘发件箱代替内存队列，服务器确认后才删除；
+            # 内存队列按目标ID去重，网络中断时最多缓存queue_maxlen项
+            path = stream_path(outbox_path, stream_id, len(streams))
+            outbox = Outbox(path, outbox_max_rows) if path is not None else None
+            detection_queue = DetectionQueue(queue_maxlen, queue_overflow,
+                                             stream_path(spill_path, stream_id, len(streams)))
+            channel = StreamChannel(stream_id, stream_client_id, detection_queue, outbox)
+            self.channels.append(channel)
+            metrics.QUEUE_DEPTH.set_function((outbox or detection_queue).__len__, "upload_%s" % stream_id)
+        self.channels_by_client = {channel.client_id: channel for channel in self.channels}
+        self.channels_by_stream = {channel.stream_id: channel for channel in self.channels}
         # fetch initial server config
         # asyncio.run(self.client_start(mac, address, client_id))
 
@@ -35,7 +207,7 @@ class wsClient:
                     await self.reconnect_server()
 
     async def client_start(self):
-        async with websockets.connect(self.address) as self.ws:
+        async with websockets.connect(self.address, compression=self.compression) as self.ws:
             msg = {
                 "client_id": self.client_id,
                 "action": "100"
@@ -55,6 +227,10 @@ class wsClient:
 
     async def recv_send_handler(self):
         print("开始发送")
+        # 发件箱从已确认的位置开始发送，上次连接中发出但未确认的数据会重发
+        for channel in self.channels:
+            channel.sent_seq = 0
+        ack_task = asyncio.create_task(self.ack_receiver())
         while self.connected:
             try:
                 '''
@@ -77,39 +253,172 @@ class wsClient:
                         await self.ws.send(json_data)
 
                 '''
-                await asyncio.sleep(1)
-                if len(self.detection_queue) != 0:
-                    data = self.detection_queue.popleft()
-                    print(data)
-                    obj_converted = util.convert_numpy_types(data)
-                    obj_json = json.dumps(obj_converted)
-                    await self.ws.send(obj_json)
+                sent = False
+                # 各路视频流轮流发送，每路每轮最多一批，繁忙的摄像头不会挤占其他摄像头的上传
+                for channel in self.channels:
+                    if not self.batch_ready(channel):
+                        continue
+                    with metrics.time_stage("serialization"):
+                        batch, pieces, seq, item_seqs = self.take_batch(channel)
+                        if not pieces:
+                            continue
+                        epoch = channel.outbox.epoch if channel.outbox is not None else None
+                        message = self.encode_batch(channel.client_id, pieces, seq, item_seqs, epoch)
+                    try:
+                        start = time.perf_counter()
+                        await self.ws.send(message)
+                        metrics.observe_stage("ws_send", time.perf_counter() - start)
+                    except Exception:
+                        # 内存队列中发送失败的数据放回队首；发件箱中的数据未确认前不会删除
+                        if channel.outbox is None:
+                            channel.detection_queue.extendleft(batch)
+                        raise
+                    metrics.ITEMS.labels("batches_sent").inc()
+                    metrics.ITEMS.labels("detections_sent").inc(len(pieces))
+                    sent = True
+                if not sent:
+                    await self.wait_for_data()
 
             except Exception as e:
                 print(e)
                 self.connected = False
+        ack_task.cancel()
+
+    async def ack_receiver(self):
+        """接收服务器对批量数据的确认"700_1"，删除发件箱中已确认的记录"""
+        try:
+            async for response in self.ws:
+                json_recv = json.loads(response)
+                if json_recv.get("msg") == "700_1":
+                    channel = self.channels_by_client.get(json_recv.get("client_id"), self.channels[0])
+                    if channel.outbox is not None:
+                        channel.outbox.ack(json_recv["seq"])
+        except Exception as e:
+            print(e)
+        self.connected = False
+        self.data_ready.set()
+
+    def batch_ready(self, channel):
+        """
+        通道是否该发送一批：攒满batch_max_items项立即发送，否则最早一项未发送数据等待flush_interval秒后发送
+        """
+        pending = channel.pending(self.batch_max_items)
+        if pending == 0:
+            channel.first_pending = None
+            return False
+        now = asyncio.get_running_loop().time()
+        if channel.first_pending is None:
+            channel.first_pending = now
+        return pending >= self.batch_max_items or now - channel.first_pending >= self.flush_interval
+
+    def take_batch(self, channel):
+        """
+        从通道取出一批待发送的检测结果，最多batch_max_items项或约batch_max_bytes字节
+        
+        返回:
+            tuple: (内存队列中取出的检测结果列表, 每项编码后的字节串列表, 本批的seq,
+                每项在发件箱中的seq，使用内存队列时为None)
+        """
+        batch = []
+        pieces = []
+        item_seqs = None
+        if channel.outbox is not None:
+            rows = channel.outbox.read(channel.sent_seq, self.batch_max_items, self.batch_max_bytes)
+            pieces = [payload for _, payload in rows]
+            item_seqs = [seq for seq, _ in rows]
+            if rows:
+                channel.sent_seq = rows[-1][0]
+        else:
+            size = 0
+            while len(pieces) < self.batch_max_items and size < self.batch_max_bytes and len(channel.detection_queue) != 0:
+                obj = util.convert_numpy_types(channel.detection_queue.popleft())
+                batch.append(obj)
+                pieces.append(self.encode_item(obj))
+                size += len(pieces[-1])
+            if pieces:
+                channel.sent_seq += 1
+        channel.first_pending = None
+        return batch, pieces, channel.sent_seq, item_seqs
+
+    async def wait_for_data(self):
+        """没有可发送的批次时等待新数据，或等到最早一个通道的flush_interval到期"""
+        loop = asyncio.get_running_loop()
+        deadlines = [channel.first_pending + self.flush_interval
+                     for channel in self.channels if channel.first_pending is not None]
+        timeout = min(deadlines) - loop.time() if deadlines else self.flush_interval
+        self.data_ready.clear()
+        try:
+            await asyncio.wait_for(self.data_ready.wait(), max(timeout, 0))
+        except asyncio.TimeoutError:
+            pass
+
+    def encode_item(self, obj):
+        if self.encoding == "msgpack":
+            return msgpack.packb(obj)
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    def encode_batch(self, client_id, pieces, seq, item_seqs=None, epoch=None):
+        """
+        把已编码的各项拼成一帧"700"消息：{"client_id", "action": "700", "seq", ["epoch", "seqs",] "data": [...]}
+        json为紧凑的JSON文本，msgpack为二进制；服务器收到后回复"700_1"和seq
+        seqs为每项在发件箱中的seq，epoch为发件箱文件的随机编号：重连后重发的批次划分可能不同，
+        服务器按(client_id, epoch, 每项seq)去重
+        """
+        header = {"client_id": client_id, "action": "700", "seq": seq}
+        if item_seqs is not None:
+            header["epoch"] = epoch
+            header["seqs"] = item_seqs
+        if self.encoding == "msgpack":
+            packer = msgpack.Packer()
+            head = b"".join(packer.pack(k) + packer.pack(v) for k, v in header.items()) + packer.pack("data")
+            return (packer.pack_map_header(len(header) + 1) + head
+                    + packer.pack_array_header(len(pieces)) + b"".join(pieces))
+        head = json.dumps(header, separators=(',', ':'))
+        return head[:-1] + ',"data":[' + b",".join(pieces).decode('utf-8') + ']}'
+
     #这个协程要记得在主函数中创建任务
     #使用队列的思想，缓存检测结果。如果发生网络中断，则在此过程中检测到的目标不会受到
     #影响
     async def data_collector(self):
         while True:
-            detections = self.tracker.get_current_detections()
-            if len(detections) != 0:
+            for channel in self.channels:
+                detections = self.tracker.get_current_detections(channel.stream_id)
+                if len(detections) == 0:
+                    continue
                 #print(f"\n当前帧检测到的对象({len(detections)}个):")
-                #print(f"\n当前帧检测到的不重复对象({len(self.detection_queue)}个):")
-                for obj in detections:
-                    if len(self.detection_queue) == 0:
-                        self.detection_queue.append(obj)
-                    # 检查当前对象的ID是否已经在队列中存在
-                    if not any(existing_obj['id'] == obj['id'] for existing_obj in self.detection_queue):
-                        self.detection_queue.append(obj)
+                if channel.outbox is not None:
+                    # 当前对象的ID已经在发件箱中时不会重复写入
+                    channel.outbox.extend((obj['id'], self.encode_item(util.convert_numpy_types(obj)))
+                                          for obj in detections)
+                else:
+                    for obj in detections:
+                        # 当前对象的ID已经在队列中时不会重复入队
+                        channel.detection_queue.append(obj)
+                self.data_ready.set()
             await asyncio.sleep(self.detect_time)
 
+    async def event_collector(self):
+        """
+        代替data_collector：订阅追踪器的轨迹事件，每个目标在确认为稳定轨迹时立即入队一次，
+        没有轮询延迟，也不会漏掉在两次轮询之间出现又消失的目标
+        """
+        async for event in self.tracker.events(kinds=("confirmed",)):
+            channel = self.channels_by_stream.get(event["stream_id"])
+            if channel is None:
+                continue
+            obj = event["object"]
+            if channel.outbox is not None:
+                channel.outbox.extend([(obj['id'], self.encode_item(util.convert_numpy_types(obj)))])
+            else:
+                channel.detection_queue.append(obj)
+            self.data_ready.set()
+
     async def reconnect_server(self):
+        metrics.RECONNECTS.labels("websocket").inc()
         try:
-            async with websockets.connect(self.address) as ws_t:
+            async with websockets.connect(self.address, compression=self.compression) as ws_t:
                 msg = {
-                    "id": self.client_id,
+                    "client_id": self.client_id,
                     "action": "600"
                 }
                 json_data = json.dumps(msg)
@@ -123,7 +432,7 @@ class wsClient:
                         self.connected = True
                         self.retries = 0
                         self.ws = ws_t
-                        await self.recv_handler()
+                        await self.recv_send_handler()
         except Exception as e:
             print("Reconnection failed, tried " + str(self.retries) + " times")
             self.retries = self.retries + 1
@@ -137,6 +446,8 @@ class wsClient:
         await self.ws.send(json_data)
 
     async def get_input(self, prompt):
+        # 只有交互式控制台才需要aioconsole
+        import aioconsole
         user_input = await aioconsole.ainput(prompt)
         return user_input
 
@@ -0,0 +1,88 @@
+'''
+模块作用：缓存每帧的YOLO检测结果，调参时直接回放检测结果而不用重新推理
+存储格式：每个(视频, 模型)组合一个目录
+    detections.npy: 所有帧的检测框按帧顺序拼接成的(总数,6) float32数组 [x1, y1, x2, y2, conf, cls]
+    offsets.npy: (帧数+1,) int64数组，第i帧的检测框为detections[offsets[i]:offsets[i+1]]
+    meta.json: 视频路径、模型路径、类别名等
+读取时以内存映射方式打开，回放时按帧切片，不需要把整个文件读入内存
+
+'''
+import hashlib
+import json
+import os
+
+import numpy as np
+
+SAMPLE_SIZE = 1 << 20
+
+
+def file_key(path, sample=True):
+    """
+    文件内容的哈希，作为缓存的键
+
+    参数:
+        path: 文件路径
+        sample: 为True时只哈希文件大小以及开头、中间、结尾各1MB，避免对长视频完整读一遍
+    """
+    h = hashlib.sha1()
+    size = os.path.getsize(path)
+    h.update(str(size).encode())
+    with open(path, 'rb') as f:
+        if not sample or size <= 3 * SAMPLE_SIZE:
+            for chunk in iter(lambda: f.read(SAMPLE_SIZE), b''):
+                h.update(chunk)
+        else:
+            for offset in (0, (size - SAMPLE_SIZE) // 2, size - SAMPLE_SIZE):
+                f.seek(offset)
+                h.update(f.read(SAMPLE_SIZE))
+    return h.hexdigest()[:16]
+
+
+def cache_path(cache_dir, video_path, model_path):
+    """按视频和模型的哈希得到缓存目录"""
+    return os.path.join(cache_dir, file_key(video_path) + "_" + file_key(model_path, sample=False))
+
+
+def write_cache(path, frame_detections, meta):
+    """
+    写入缓存
+
+    参数:
+        path: 缓存目录
+        frame_detections: 每帧一个(N,6)检测数组
+        meta: 写入meta.json的附加信息
+    """
+    os.makedirs(path, exist_ok=True)
+    counts = [len(dets) for dets in frame_detections]
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    if frame_detections:
+        detections = np.concatenate(frame_detections).astype(np.float32)
+    else:
+        detections = np.empty((0, 6), dtype=np.float32)
+    np.save(os.path.join(path, "detections.npy"), detections.reshape(-1, 6))
+    np.save(os.path.join(path, "offsets.npy"), offsets)
+    # meta.json最后写入，它存在即表示缓存完整
+    with open(os.path.join(path, "meta.json"), 'w', encoding='utf-8') as f:
+        json.dump(dict(meta, frames=len(counts)), f, ensure_ascii=False)
+
+
+def is_complete(path):
+    return os.path.exists(os.path.join(path, "meta.json"))
+
+
+class DetectionCache:
+    """以内存映射方式读取的检测缓存，cache[i]返回第i帧的(N,6)检测数组"""
+
+    def __init__(self, path):
+        self.path = path
+        self.detections = np.load(os.path.join(path, "detections.npy"), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        with open(os.path.join(path, "meta.json"), encoding='utf-8') as f:
+            self.meta = json.load(f)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return np.asarray(self.detections[self.offsets[i]:self.offsets[i + 1]], dtype=float)
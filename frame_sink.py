@@ -0,0 +1,137 @@
+'''
+模块作用：在后台线程中编码输出标注后的视频帧，代替cv2.imshow
+追踪循环只调用submit()把帧放入有界队列，队列满时直接丢弃这一帧（计入dropped），
+编码再慢也不会拖住追踪
+    VideoFileSink: 写入视频文件，每路视频流一个文件
+    MJPEGSink: 以HTTP multipart MJPEG流提供最新一帧，浏览器打开 http://<host>:<port>/<视频流编号> 即可查看
+
+'''
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+
+import metrics
+
+
+class FrameSink:
+    """后台编码线程的基类，子类实现write()和可选的on_close()"""
+
+    def __init__(self, max_pending=4):
+        self.frames = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+        self.written = 0
+        self.thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+        self.thread.start()
+
+    def submit(self, stream_id, frame):
+        """非阻塞地提交一帧，编码线程跟不上时丢弃"""
+        try:
+            self.frames.put_nowait((stream_id, frame))
+        except queue.Full:
+            self.dropped += 1
+            metrics.DROPPED.labels("output_sink").inc()
+
+    def _run(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                break
+            self.write(*item)
+            self.written += 1
+        self.on_close()
+
+    def write(self, stream_id, frame):
+        raise NotImplementedError
+
+    def on_close(self):
+        pass
+
+    def close(self):
+        """写完已提交的帧后停止编码线程"""
+        self.frames.put(None)
+        self.thread.join()
+
+
+class VideoFileSink(FrameSink):
+    def __init__(self, path="output_{stream_id}.mp4", fps=25, fourcc="mp4v", max_pending=4):
+        """
+        参数:
+            path: 输出文件路径，{stream_id}替换为视频流编号
+            fps: 输出视频帧率
+            fourcc: 编码器四字符码
+            max_pending: 等待编码的最大帧数
+        """
+        self.path = path
+        self.fps = fps
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self.writers = {}
+        super().__init__(max_pending)
+
+    def write(self, stream_id, frame):
+        writer = self.writers.get(stream_id)
+        if writer is None:
+            height, width = frame.shape[:2]
+            writer = self.writers[stream_id] = cv2.VideoWriter(
+                self.path.format(stream_id=stream_id), self.fourcc, self.fps, (width, height))
+        writer.write(frame)
+
+    def on_close(self):
+        for writer in self.writers.values():
+            writer.release()
+
+
+class MJPEGSink(FrameSink):
+    def __init__(self, port=8080, quality=80, max_pending=2):
+        """
+        参数:
+            port: HTTP监听端口
+            quality: JPEG质量
+            max_pending: 等待编码的最大帧数
+        """
+        self.quality = quality
+        # 每路视频流最新编码好的一帧，HTTP客户端总是拿到最新的画面
+        self.latest = {}
+        self.frame_ready = threading.Condition()
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                try:
+                    stream_id = int(self.path.strip("/") or 0)
+                except ValueError:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+                self.end_headers()
+                last = None
+                try:
+                    while True:
+                        with sink.frame_ready:
+                            sink.frame_ready.wait_for(lambda: sink.latest.get(stream_id) is not last)
+                            last = sink.latest[stream_id]
+                        self.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: "
+                                         + str(len(last)).encode() + b"\r\n\r\n" + last + b"\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="MJPEGServer", daemon=True).start()
+        super().__init__(max_pending)
+
+    def write(self, stream_id, frame):
+        ok, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if ok:
+            with self.frame_ready:
+                self.latest[stream_id] = jpeg.tobytes()
+                self.frame_ready.notify_all()
+
+    def on_close(self):
+        self.server.shutdown()
+        self.server.server_close()
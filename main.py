@@ -3,23 +3,40 @@ from track import Tracker
 #import time
 from client import wsClient
 
-from util import load_config
+from util import load_config, load_streams, load_profile
+import metrics
 
 
-async def main(server, client_id, detect_time):
+async def main(server, client_id, detect_time, streams, profile):
+    # 各阶段耗时和计数在 http://127.0.0.1:9100/metrics 查看
+    metrics.start_http_server(9100)
 
+    # 所有视频流共用一个Tracker（只加载一次YOLO模型，多路帧合并推理），每路视频流有独立的SORT状态
     tracker = Tracker(
         model_path="yolov8n.pt", 
         stable_frames_threshold=48,
         verbose=False,  # 这里设置为False来禁止YOLO输出
-        tracker="sort"
+        tracker="sort",
+        batch_size=len(streams),
+        stream_fps={stream["id"]: stream["fps"] for stream in streams if stream["fps"]},
+        profile_dir=profile["dir"],
+        profile_seconds=profile["seconds"],
+        profile_mode=profile["mode"]
     )
 
-    video_source = "traffic.avi"  # 或者使用摄像头：video_source = 0
-    tracking_task = asyncio.create_task(tracker.track_objects(video_source))
-    client = wsClient(server, client_id, detect_time, tracker)
+    # 检测结果先写入每路视频流自己的本地发件箱，服务器确认后才删除，断网或重启都不会丢失；
+    # 所有视频流通过同一条websocket连接上传
+    client = wsClient(server, client_id, detect_time, tracker, outbox_path="outbox_{stream_id}.db",
+                      streams={stream["id"]: stream["client_id"] for stream in streams})
     client_task = asyncio.create_task(client.client_control())
-    data_collect_task = asyncio.create_task(client.data_collector())
+    # 追踪器在目标成为稳定轨迹时推送事件，不再按detect_time轮询
+    data_collect_task = asyncio.create_task(client.event_collector())
+
+    # 事件订阅先于追踪开始，第一帧的事件也不会错过
+    video_sources = {stream["id"]: stream["source"] for stream in streams}
+    tracking_task = asyncio.create_task(tracker.track_objects(video_sources))
+    if profile["on_start"]:
+        tracker.start_profiling()
     await asyncio.gather(tracking_task, client_task, data_collect_task)
 
 
@@ -29,7 +46,10 @@ if __name__ == "__main__":
         print(f"Server: {server}")
         print(f"Client ID: {client_id}")
         print(f"Detect Time: {detect_time}")
+        streams = load_streams()
+        print(f"Streams: {len(streams)}")
+        profile = load_profile()
     except Exception as e:
         print(f"加载配置失败: {e}")
 
-    asyncio.run(main(server, client_id, detect_time))
\ No newline at end of file
+    asyncio.run(main(server, client_id, detect_time, streams, profile))
\ No newline at end of file
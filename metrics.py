@@ -0,0 +1,239 @@
+'''
+模块作用：轻量的运行指标（直方图、计数器、瞬时值），以Prometheus文本格式在本地HTTP端口提供
+每次记录只是一次加锁的bisect和几次加法，可以在生产环境常开
+    STAGE_SECONDS: 各处理阶段耗时的直方图，按stage标签区分
+    FRAMES, DROPPED, RECONNECTS...: 计数器
+    Gauge(fn=...): 抓取时才调用fn取值，用于队列深度等瞬时值
+用法：
+    with metrics.time_stage("inference"):
+        ...
+    metrics.start_http_server(9100)
+
+'''
+import bisect
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 耗时直方图的桶边界(秒)，覆盖0.1ms到10s
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 10.)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('%s="%s"' % (k, v) for k, v in pairs) + "}"
+
+
+class Metric:
+    """带标签的指标：labels(...)返回对应标签值的子指标，没有标签时直接在指标上记录"""
+    kind = None
+
+    def __init__(self, name, help, labelnames=(), registry=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        if not self.labelnames:
+            return self._children.get((), self._new_child()).samples(self.name, (), ())
+        lines = []
+        for values, child in list(self._children.items()):
+            lines.extend(child.samples(self.name, self.labelnames, values))
+        return lines
+
+    def render(self):
+        return ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.kind)] + self._samples()
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labelnames, values):
+        return ["%s%s %s" % (name, _format_labels(labelnames, values), self.value)]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class _GaugeChild:
+    def __init__(self, fn=None):
+        self.value = 0.
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name, labelnames, values):
+        value = self.fn() if self.fn is not None else self.value
+        return ["%s%s %s" % (name, _format_labels(labelnames, values), value)]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, fn, *labelvalues):
+        """抓取时调用fn()取值，用于队列深度等不需要主动更新的值"""
+        self.labels(*labelvalues).fn = fn
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def samples(self, name, labelnames, values):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append("%s_bucket%s %d" % (name, _format_labels(labelnames, values, [("le", le)]), cumulative))
+        lines.append("%s_sum%s %s" % (name, _format_labels(labelnames, values), total))
+        lines.append("%s_count%s %d" % (name, _format_labels(labelnames, values), cumulative))
+        return lines
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = Histogram("stage_seconds", "Time spent in each processing stage", ["stage"])
+FRAMES = Counter("frames_total", "Frames processed by the tracker", ["stream"])
+DROPPED = Counter("dropped_total", "Frames or items dropped", ["kind"])
+RECONNECTS = Counter("reconnects_total", "Websocket or capture reconnections", ["kind"])
+TRACKS = Gauge("tracks", "Tracks reported on the last processed frame", ["stream"])
+QUEUE_DEPTH = Gauge("queue_depth", "Current queue depth", ["queue"])
+ITEMS = Counter("items_total", "Items passing through a stage", ["kind"])
+
+
+class _StageTimer:
+    __slots__ = ("child", "start")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+        return False
+
+
+def time_stage(stage):
+    """计时上下文管理器，耗时记入STAGE_SECONDS{stage=...}"""
+    return _StageTimer(STAGE_SECONDS.labels(stage))
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def start_http_server(port, host="127.0.0.1", registry=None, reuse_port=False):
+    """
+    在后台线程提供 http://host:port/metrics
+
+    reuse_port: 以SO_REUSEPORT监听，滚动重启时新旧进程可以短暂同时绑定同一端口
+    """
+    registry = registry or REGISTRY
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+
+        def server_bind(self):
+            if reuse_port:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            super().server_bind()
+
+    server = Server((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
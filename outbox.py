@@ -0,0 +1,138 @@
+'''
+模块作用：检测结果的本地持久化发件箱，网络中断或程序重启时数据不丢失
+实现：SQLite WAL模式下的只追加表，seq为单调递增的偏移量（AUTOINCREMENT，删除后不复用）
+    写入：data_collector按批写入已编码的检测结果，同一目标ID在未确认前只保存一份
+    读取：发送端按seq从上次发送的位置往后读取，不从表中删除
+    确认：服务器确认某个seq后删除该seq及之前的记录，累计删除一定数量后做WAL检查点压缩
+    epoch：新建发件箱文件时生成的随机编号，与seq一起上传；文件重建后seq从1重新开始，
+        服务器按(client_id, epoch, seq)识别重发的记录，不会把新文件中的记录当作重复
+
+'''
+import sqlite3
+import uuid
+
+
+class Outbox:
+    def __init__(self, path, max_rows=None, compact_every=1000):
+        """
+        参数:
+            path: SQLite数据库文件路径
+            max_rows: 最多保存的未确认记录数，超出时丢弃最旧的记录；None为不限制
+            compact_every: 累计确认删除多少条记录后截断WAL文件
+        """
+        self.path = path
+        self.max_rows = max_rows
+        self.compact_every = compact_every
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # WAL模式下NORMAL只在检查点时fsync，断电最多丢失最近的事务，程序崩溃不丢数据
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "obj_id UNIQUE NOT NULL, "
+            "payload BLOB NOT NULL)"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.execute("INSERT OR IGNORE INTO meta VALUES ('epoch', ?)", (uuid.uuid4().hex,))
+        self.conn.commit()
+        self.epoch = self.conn.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()[0]
+        self._count = self.conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        self._deleted_since_compact = 0
+        # 统计计数
+        self.dropped = 0
+        self.duplicates = 0
+        self.acked = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, obj_id):
+        row = self.conn.execute("SELECT 1 FROM outbox WHERE obj_id = ?", (obj_id,)).fetchone()
+        return row is not None
+
+    def extend(self, items):
+        """
+        在一个事务中写入一批记录
+
+        参数:
+            items: [(obj_id, payload), ...]，payload为已编码的字节串；obj_id已在发件箱中的记录被忽略
+
+        返回:
+            实际写入的条数
+        """
+        items = list(items)
+        if not items:
+            return 0
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO outbox (obj_id, payload) VALUES (?, ?)", items)
+            inserted = self.conn.total_changes - before
+            self._count += inserted
+            self.duplicates += len(items) - inserted
+            if self.max_rows is not None and self._count > self.max_rows:
+                overflow = self._count - self.max_rows
+                self.conn.execute(
+                    "DELETE FROM outbox WHERE seq IN (SELECT seq FROM outbox ORDER BY seq LIMIT ?)",
+                    (overflow,)
+                )
+                self._count -= overflow
+                self.dropped += overflow
+        return inserted
+
+    def read(self, after_seq, max_items, max_bytes=None):
+        """
+        读取seq大于after_seq的记录，不删除
+
+        参数:
+            after_seq: 已发送的最后一个seq
+            max_items: 最多读取的条数
+            max_bytes: 累计payload达到该字节数后停止（至少返回一条）
+
+        返回:
+            [(seq, payload), ...]，按seq升序
+        """
+        rows = self.conn.execute(
+            "SELECT seq, payload FROM outbox WHERE seq > ? ORDER BY seq LIMIT ?",
+            (after_seq, max_items)
+        ).fetchall()
+        if max_bytes is None:
+            return rows
+        size = 0
+        for i, (_, payload) in enumerate(rows):
+            size += len(payload)
+            if size >= max_bytes:
+                return rows[:i + 1]
+        return rows
+
+    def count_after(self, after_seq, limit):
+        """seq大于after_seq（尚未发送）的记录数，最多数到limit"""
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM (SELECT 1 FROM outbox WHERE seq > ? LIMIT ?)", (after_seq, limit)
+        ).fetchone()[0]
+
+    def ack(self, seq):
+        """服务器确认收到seq及之前的全部记录后删除它们"""
+        with self.conn:
+            deleted = self.conn.execute("DELETE FROM outbox WHERE seq <= ?", (seq,)).rowcount
+        self._count -= deleted
+        self.acked += deleted
+        self._deleted_since_compact += deleted
+        if self._deleted_since_compact >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """把WAL写回主库并截断WAL文件，释放已确认记录占用的空间"""
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._deleted_since_compact = 0
+
+    def stats(self):
+        return {
+            "queued": self._count,
+            "dropped": self.dropped,
+            "duplicates": self.duplicates,
+            "acked": self.acked,
+        }
+
+    def close(self):
+        self.conn.close()
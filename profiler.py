@@ -0,0 +1,112 @@
+'''
+模块作用：在不重启进程的情况下对运行中的追踪程序做一段时间的性能剖析
+    SamplingProfiler: 后台线程定期采样所有线程的调用栈（包括YOLO推理线程和读帧线程），
+        输出折叠栈格式(.folded)，可直接用 flamegraph.pl 或 speedscope 生成火焰图
+    CProfileSession: 对事件循环线程（追踪、SORT、类别匹配等Python逻辑）做cProfile，
+        输出pstats文件(.prof)，可用 snakeviz 或 flameprof 查看
+未开启剖析时不在任何处理路径上增加开销
+
+'''
+import cProfile
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class SamplingProfiler:
+    def __init__(self, path, seconds=30., interval=0.005):
+        """
+        参数:
+            path: 输出的折叠栈文件路径
+            seconds: 采样时长(秒)
+            interval: 采样间隔(秒)
+        """
+        self.path = path
+        self.seconds = seconds
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def is_alive(self):
+        return self.thread.is_alive()
+
+    def _sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == self.thread.ident:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            # 折叠栈格式：根在前，分号分隔，每个线程作为最外层一帧
+            stack.append(names.get(ident, str(ident)))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self):
+        deadline = time.monotonic() + self.seconds
+        while time.monotonic() < deadline:
+            self._sample()
+            time.sleep(self.interval)
+        self.write()
+
+    def write(self):
+        with open(self.path, "w") as file:
+            for stack, count in self.stacks.most_common():
+                file.write("%s %d\n" % (stack, count))
+        print("Profile written to %s (%d samples)" % (self.path, self.samples))
+
+
+class CProfileSession:
+    """cProfile只统计调用enable()的线程，必须在事件循环线程中创建和start()"""
+
+    def __init__(self, path, seconds=30.):
+        self.path = path
+        self.seconds = seconds
+        self.profile = cProfile.Profile()
+        self.running = False
+
+    def start(self, loop):
+        self.running = True
+        self.profile.enable()
+        loop.call_later(self.seconds, self.stop)
+        return self
+
+    def is_alive(self):
+        return self.running
+
+    def stop(self):
+        self.profile.disable()
+        self.profile.dump_stats(self.path)
+        self.running = False
+        print("Profile written to %s" % self.path)
+
+
+def start(path_prefix, seconds=30., mode="sample", loop=None):
+    """
+    开始一次剖析，返回进行中的剖析对象
+
+    参数:
+        path_prefix: 输出文件路径（不含扩展名），sample模式加.folded，cprofile模式加.prof
+        seconds: 剖析时长(秒)
+        mode: "sample"为所有线程的调用栈采样，"cprofile"为事件循环线程的cProfile
+        loop: cprofile模式下的事件循环
+    """
+    if mode == "sample":
+        return SamplingProfiler(path_prefix + ".folded", seconds).start()
+    if mode == "cprofile":
+        return CProfileSession(path_prefix + ".prof", seconds).start(loop)
+    raise ValueError("mode必须是'sample'或'cprofile'")
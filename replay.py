@@ -0,0 +1,51 @@
+'''
+模块作用：用缓存的检测结果做追踪参数扫描
+第一次运行时对视频做一遍YOLO检测并缓存，之后每组参数只回放缓存，不再推理
+
+用法示例：
+    python replay.py --video traffic.avi --stable_frames_threshold 24 48 --max_age 1 5 --min_hits 1 3
+
+'''
+import argparse
+import itertools
+import time
+
+from track import Tracker
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Replay cached detections with different tracking parameters')
+    parser.add_argument("--video", required=True, help="视频文件路径")
+    parser.add_argument("--model", default="yolov8n.pt", help="YOLO模型路径")
+    parser.add_argument("--cache_dir", default="det_cache", help="检测缓存根目录")
+    parser.add_argument("--batch_size", type=int, default=8, help="缓存阶段每次YOLO推理的帧数")
+    parser.add_argument("--stable_frames_threshold", type=int, nargs="+", default=[48])
+    parser.add_argument("--detect_interval", type=int, nargs="+", default=[1])
+    parser.add_argument("--max_age", type=int, nargs="+", default=[1])
+    parser.add_argument("--min_hits", type=int, nargs="+", default=[3])
+    parser.add_argument("--iou_threshold", type=float, nargs="+", default=[0.3])
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    tracker = Tracker(model_path=args.model, batch_size=args.batch_size, tracker="sort")
+    start = time.perf_counter()
+    cache = tracker.cache_detections(args.video, args.cache_dir)
+    print("Detection cache: %s (%.1fs)" % (cache, time.perf_counter() - start))
+
+    print("%9s %9s %8s %8s %9s %9s %10s" % ("stable", "interval", "max_age", "min_hits", "iou", "fps", "stable IDs"))
+    for stable, interval, max_age, min_hits, iou in itertools.product(
+            args.stable_frames_threshold, args.detect_interval, args.max_age, args.min_hits, args.iou_threshold):
+        tracker.stable_frames_threshold = stable
+        tracker.detect_interval = interval
+        tracker.tracker_params = {"max_age": max_age, "min_hits": min_hits, "iou_threshold": iou}
+        tracker.reset_stream()
+        stable_ids = set()
+        frames = 0
+        start = time.perf_counter()
+        for _, detections in tracker.replay(cache):
+            stable_ids.update(obj['id'] for obj in detections)
+            frames += 1
+        fps = frames / max(time.perf_counter() - start, 1e-9)
+        print("%9d %9d %8d %8d %9.2f %9.0f %10d" % (stable, interval, max_age, min_hits, iou, fps, len(stable_ids)))
@@ -0,0 +1,64 @@
+'''
+模块作用：把客户端上传的检测结果批量写入SQLite
+每次insert_many在一个事务中写入多批数据，由ingest worker在单独的线程中调用
+使用发件箱的客户端重连后会重发未确认的数据，(client_id, outbox_epoch, item_seq)唯一，重发的行被忽略
+
+'''
+import sqlite3
+
+
+class DetectionStore:
+    def __init__(self, path):
+        self.path = path
+        # 连接在事件循环线程中创建，在写入线程中使用
+        # 多进程模式下各worker写同一个库，等待其他进程的写锁而不是立即报错
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS detections ("
+            "client_id TEXT NOT NULL, "
+            "seq INTEGER NOT NULL, "
+            "obj_id INTEGER, "
+            "class TEXT, "
+            "x1 INTEGER, y1 INTEGER, x2 INTEGER, y2 INTEGER, "
+            "age INTEGER, "
+            "received_at REAL NOT NULL, "
+            "item_seq INTEGER, "
+            "outbox_epoch TEXT)"
+        )
+        # 旧版本创建的表没有item_seq/outbox_epoch列
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(detections)")}
+        for column, column_type in (("item_seq", "INTEGER"), ("outbox_epoch", "TEXT")):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE detections ADD COLUMN {column} {column_type}")
+        # item_seq为发件箱中每项的seq，outbox_epoch为发件箱文件的随机编号：文件重建后seq从1重新开始，
+        # 只按seq去重会把新数据当作重复丢弃；不使用发件箱的客户端两者为NULL，NULL之间不视为重复
+        self.conn.execute("DROP INDEX IF EXISTS detections_item")
+        self.conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS detections_outbox_item "
+            "ON detections (client_id, outbox_epoch, item_seq)")
+        self.conn.commit()
+
+    @staticmethod
+    def to_row(client_id, seq, obj, received_at, outbox_epoch=None, item_seq=None):
+        bbox = obj.get('bbox') or (None, None, None, None)
+        return (client_id, seq, obj.get('id'), obj.get('class'), *bbox, obj.get('age'), received_at,
+                item_seq, outbox_epoch)
+
+    def insert_many(self, rows):
+        """
+        在一个事务中写入多行，rows为to_row()返回的元组；已写入过的(client_id, outbox_epoch, item_seq)被忽略
+
+        返回:
+            int: 实际写入的行数
+        """
+        with self.conn:
+            cursor = self.conn.executemany(
+                "INSERT OR IGNORE INTO detections "
+                "(client_id, seq, obj_id, class, x1, y1, x2, y2, age, received_at, item_seq, outbox_epoch) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return cursor.rowcount
+
+    def close(self):
+        self.conn.close()
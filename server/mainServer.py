@@ -1,14 +1,154 @@
 import time
 import asyncio
+import argparse
+import multiprocessing
+import queue
+import signal
 from wsServer import wsSocket
+import metrics
 
+PORT = 4000
+# 指标端口，多进程模式下worker i使用METRICS_PORT + 1 + i
+METRICS_PORT = 9101
+# worker收到SIGTERM后写完已收到批次的最长等待时间(秒)，超时后强制结束
+WORKER_STOP_TIMEOUT = 30
 
 
 async def main():
-    ws_socket = wsSocket(4000)
+    metrics.start_http_server(METRICS_PORT)
+    ws_socket = wsSocket(PORT)
     ws_task = asyncio.create_task(ws_socket.start_ws_server())
     await ws_task
 
 
+async def worker_main(worker_id, stats_sink, stats_interval):
+    """
+    多进程模式下的单个worker：以SO_REUSEPORT绑定同一端口，收到SIGTERM后把已收到的批次写完再退出
+
+    客户端登记表self.clients按worker划分，只记录连到本进程的客户端；重连（"600"）落到哪个worker
+    就在哪个worker重新登记，断开的连接会从原worker的登记表中移除，因此不需要跨进程共享
+    """
+    # 滚动重启时新worker先于旧worker启动，指标端口同样以SO_REUSEPORT绑定
+    metrics.start_http_server(METRICS_PORT + 1 + worker_id, reuse_port=True)
+    ws_socket = wsSocket(PORT, reuse_port=True, worker_id=worker_id,
+                         stats_sink=stats_sink, stats_interval=stats_interval)
+    loop = asyncio.get_running_loop()
+    ws_task = asyncio.create_task(ws_socket.start_ws_server())
+    # stop_event在start_ws_server中创建，先让它运行到等待停止的位置
+    await asyncio.sleep(0)
+    loop.add_signal_handler(signal.SIGTERM, ws_socket.stop)
+    loop.add_signal_handler(signal.SIGINT, ws_socket.stop)
+    await ws_task
+
+
+def run_worker(worker_id, stats_sink, stats_interval):
+    # fork出的worker继承了supervisor的信号处理函数（只设置supervisor的标志位），
+    # 在worker_main安装事件循环的信号处理之前收到SIGTERM会被忽略，因此先恢复默认处理
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, signal.SIG_DFL)
+    asyncio.run(worker_main(worker_id, stats_sink, stats_interval))
+
+
+class Supervisor:
+    """
+    启动num_workers个worker进程监听同一端口，汇总各worker上报的统计
+
+    SIGHUP：滚动重启，先启动新worker再让旧worker优雅退出，端口始终有进程在监听
+    SIGTERM/SIGINT：所有worker优雅退出后supervisor退出
+    worker意外退出时自动拉起
+    """
+
+    def __init__(self, num_workers, stats_interval=10):
+        self.num_workers = num_workers
+        self.stats_interval = stats_interval
+        self.stats_sink = multiprocessing.Queue()
+        self.workers = {}
+        # 每个worker最近一次上报的统计
+        self.worker_stats = {}
+        self.restart_requested = False
+        self.stopping = False
+
+    def spawn(self, worker_id):
+        process = multiprocessing.Process(target=run_worker,
+                                          args=(worker_id, self.stats_sink, self.stats_interval))
+        process.start()
+        self.workers[worker_id] = process
+        return process
+
+    def rolling_restart(self):
+        for worker_id, old in list(self.workers.items()):
+            self.spawn(worker_id)
+            old.terminate()
+            self.join_worker(worker_id, old, WORKER_STOP_TIMEOUT)
+        print("All workers restarted")
+
+    def stop_all(self):
+        for process in self.workers.values():
+            process.terminate()
+        deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+        for worker_id, process in self.workers.items():
+            self.join_worker(worker_id, process, max(0., deadline - time.monotonic()))
+
+    def join_worker(self, worker_id, process, timeout):
+        """等待已发送SIGTERM的worker退出，超时仍未退出时用SIGKILL结束"""
+        process.join(timeout)
+        if process.is_alive():
+            print("Worker " + str(worker_id) + " did not exit in time, killing")
+            process.kill()
+            process.join()
+
+    def aggregate_stats(self):
+        """合并各worker的统计；同一客户端重连到不同worker时计数相加"""
+        clients = {}
+        connected = 0
+        ingest_queue = 0
+        for snapshot in self.worker_stats.values():
+            connected += snapshot["connected"]
+            ingest_queue += snapshot["ingest_queue"]
+            for client_id, m in snapshot["metrics"].items():
+                total = clients.setdefault(client_id, dict.fromkeys(("batches", "detections", "bytes", "stored_batches"), 0))
+                for key in total:
+                    total[key] += m[key]
+        return {"connected": connected, "ingest_queue": ingest_queue, "clients": clients}
+
+    def print_stats(self):
+        stats = self.aggregate_stats()
+        detections = sum(m["detections"] for m in stats["clients"].values())
+        print(f"workers: {len(self.workers)}; clients: {stats['connected']} connected, "
+              f"{len(stats['clients'])} seen; detections: {detections}; ingest queue: {stats['ingest_queue']}")
+
+    def run(self):
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, "restart_requested", True))
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, "stopping", True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, "stopping", True))
+        for worker_id in range(self.num_workers):
+            self.spawn(worker_id)
+        last_print = time.monotonic()
+        while not self.stopping:
+            try:
+                worker_id, snapshot = self.stats_sink.get(timeout=1)
+                self.worker_stats[worker_id] = snapshot
+            except queue.Empty:
+                pass
+            if self.restart_requested:
+                self.restart_requested = False
+                self.rolling_restart()
+            for worker_id, process in list(self.workers.items()):
+                if not process.is_alive() and not self.stopping:
+                    print("Worker " + str(worker_id) + " exited with code " + str(process.exitcode) + ", restarting")
+                    self.spawn(worker_id)
+            if time.monotonic() - last_print >= self.stats_interval:
+                self.print_stats()
+                last_print = time.monotonic()
+        self.stop_all()
+
+
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker进程数，大于1时以SO_REUSEPORT多进程监听同一端口")
+    args = parser.parse_args()
+    if args.workers > 1:
+        Supervisor(args.workers).run()
+    else:
+        asyncio.run(main())
@@ -0,0 +1,74 @@
+import sqlite3
+
+from detectionStore import DetectionStore
+
+
+def make_rows(client_id, seq, item_seqs, received_at, epoch="a"):
+    objs = [{'id': i, 'class': 'car', 'bbox': (i, i, i + 10, i + 10), 'age': 48} for i in range(len(item_seqs))]
+    return [DetectionStore.to_row(client_id, seq, obj, received_at, epoch if item_seq is not None else None, item_seq)
+            for obj, item_seq in zip(objs, item_seqs)]
+
+
+def count_rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM detections").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_replayed_batch_is_stored_once(tmp_path):
+    path = str(tmp_path / "detections.db")
+    store = DetectionStore(path)
+    assert store.insert_many(make_rows("cam", 3, [1, 2, 3], 1.)) == 3
+    # 重连后重发同一批次：received_at不同，内容被忽略
+    assert store.insert_many(make_rows("cam", 3, [1, 2, 3], 2.)) == 0
+    store.close()
+    assert count_rows(path) == 3
+
+
+def test_rebatched_resend_only_stores_new_items(tmp_path):
+    path = str(tmp_path / "detections.db")
+    store = DetectionStore(path)
+    store.insert_many(make_rows("cam", 2, [1, 2], 1.))
+    # 重发时批次划分不同，本批的seq也不同
+    assert store.insert_many(make_rows("cam", 4, [1, 2, 3, 4], 2.)) == 2
+    # 其他客户端的相同seq不是重复
+    assert store.insert_many(make_rows("cam2", 2, [1, 2], 2.)) == 2
+    store.close()
+    assert count_rows(path) == 6
+
+
+def test_new_outbox_epoch_is_not_a_duplicate(tmp_path):
+    path = str(tmp_path / "detections.db")
+    store = DetectionStore(path)
+    store.insert_many(make_rows("cam", 3, [1, 2, 3], 1., epoch="a"))
+    # 客户端的发件箱文件重建后seq从1重新开始
+    assert store.insert_many(make_rows("cam", 2, [1, 2], 2., epoch="b")) == 2
+    assert store.insert_many(make_rows("cam", 2, [1, 2], 3., epoch="b")) == 0
+    store.close()
+    assert count_rows(path) == 5
+
+
+def test_rows_without_item_seq_are_not_deduplicated(tmp_path):
+    path = str(tmp_path / "detections.db")
+    store = DetectionStore(path)
+    store.insert_many(make_rows("cam", 1, [None, None], 1.))
+    assert store.insert_many(make_rows("cam", 1, [None, None], 2.)) == 2
+    store.close()
+    assert count_rows(path) == 4
+
+
+def test_table_without_outbox_columns_is_migrated(tmp_path):
+    path = str(tmp_path / "detections.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE detections (client_id TEXT NOT NULL, seq INTEGER NOT NULL, obj_id INTEGER, "
+                 "class TEXT, x1 INTEGER, y1 INTEGER, x2 INTEGER, y2 INTEGER, age INTEGER, received_at REAL NOT NULL)")
+    conn.execute("INSERT INTO detections VALUES ('cam', 1, 1, 'car', 0, 0, 10, 10, 48, 1.)")
+    conn.commit()
+    conn.close()
+    store = DetectionStore(path)
+    store.insert_many(make_rows("cam", 2, [5], 2.))
+    assert store.insert_many(make_rows("cam", 2, [5], 3.)) == 0
+    store.close()
+    assert count_rows(path) == 2
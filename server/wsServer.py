@@ -1,37 +1,165 @@
 import websockets
 import asyncio
 import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 from websockets.legacy.server import WebSocketServerProtocol
+from detectionStore import DetectionStore
+# 指标模块与客户端共用，位于上一级目录
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
 
 class wsSocket:
     client = {}
     test_state = False
 
-    def __init__(self, _port):
+    def __init__(self, _port, db_path="detections.db", ingest_queue_size=1024, num_workers=2,
+                 flush_batches=64, stats_interval=10, reuse_port=False, worker_id=None, stats_sink=None):
+        """
+        参数:
+            _port: 监听端口
+            db_path: 检测结果SQLite数据库路径
+            ingest_queue_size: 待写入批次队列的容量，满时对应客户端的接收协程等待，形成背压
+            num_workers: 写入worker协程数
+            flush_batches: 每个worker一次最多合并写入的批次数
+            stats_interval: 汇总打印客户端统计的间隔(秒)，None为不打印
+            reuse_port: 以SO_REUSEPORT监听，多个worker进程绑定同一端口由内核分配连接
+            worker_id: 多进程模式下的worker编号
+            stats_sink: 多进程模式下上报统计的队列，设置后统计交给supervisor汇总而不是打印
+        """
         self.port = _port
-        print("Websocket server started at port " + str(self.port) + " on 0.0.0.0")
+        self.worker_id = worker_id
+        prefix = "" if worker_id is None else "Worker " + str(worker_id) + ": "
+        print(prefix + "Websocket server started at port " + str(self.port) + " on 0.0.0.0")
         self.clients = {}
+        self.store = DetectionStore(db_path)
+        # SQLite写入在单个线程中串行执行，事件循环不会被磁盘IO阻塞
+        self.store_executor = ThreadPoolExecutor(max_workers=1)
+        self.ingest_queue_size = ingest_queue_size
+        self.num_workers = num_workers
+        self.flush_batches = flush_batches
+        self.stats_interval = stats_interval
+        self.reuse_port = reuse_port
+        self.stats_sink = stats_sink
+        # 每个客户端的统计：收到的批次、检测结果数、字节数、已写入的批次、最后活跃时间
+        self.metrics = {}
+
+    def client_metrics(self, client_id):
+        if client_id not in self.metrics:
+            self.metrics[client_id] = {
+                "batches": 0,
+                "detections": 0,
+                "bytes": 0,
+                "stored_batches": 0,
+                "last_seen": None,
+            }
+        return self.metrics[client_id]
 
     async def ws_handle(self, websocket: WebSocketServerProtocol):
-        async for message in websocket:
-            print(message)
-            json_recv = json.loads(message)
-            if "client_id" in json_recv:
-                id = json_recv["client_id"]
-                action = json_recv["action"]
-                if id not in self.clients and action == "100":
-                    self.clients[id] = websocket
-                    print("New connection " + id + " established successfully")
-                    await self.sendmsg(id, "100_1")
-                if id in self.clients and action == "800":
-                    await self.sendmsg(id, "800_1")
-                    del self.clients[id]
-                    print(id + " disconnected")
-                if action == "600":
-                    self.clients[id] = websocket
-                    await self.sendmsg(id, "600_1")
-                    print(id + " reconnected")
+        client_id = None
+        try:
+            async for message in websocket:
+                # 客户端批量上传的检测结果可以是msgpack编码的二进制帧
+                start = time.perf_counter()
+                if isinstance(message, bytes):
+                    if msgpack is None:
+                        print("收到msgpack数据但未安装msgpack，已忽略")
+                        continue
+                    json_recv = msgpack.unpackb(message)
+                else:
+                    json_recv = json.loads(message)
+                metrics.observe_stage("decode", time.perf_counter() - start)
+                if "client_id" in json_recv:
+                    id = json_recv["client_id"]
+                    action = json_recv["action"]
+                    client_id = id
+                    if action == "700":
+                        # 批量检测结果进入写入队列，写入后由worker回复"700_1"
+                        counts = self.client_metrics(id)
+                        counts["batches"] += 1
+                        counts["detections"] += len(json_recv["data"])
+                        counts["bytes"] += len(message)
+                        counts["last_seen"] = time.time()
+                        metrics.ITEMS.labels("batches_received").inc()
+                        metrics.ITEMS.labels("detections_received").inc(len(json_recv["data"]))
+                        # 使用发件箱的客户端附带发件箱的epoch和每项的seq，服务器据此忽略重发的数据
+                        item_seqs = json_recv.get("seqs") or [None] * len(json_recv["data"])
+                        await self.ingest_queue.put((id, json_recv["seq"], json_recv["data"],
+                                                     json_recv.get("epoch"), item_seqs, websocket))
+                        continue
+                    if id not in self.clients and action == "100":
+                        self.clients[id] = websocket
+                        print("New connection " + id + " established successfully")
+                        await self.sendmsg(id, "100_1")
+                    if id in self.clients and action == "800":
+                        await self.sendmsg(id, "800_1")
+                        del self.clients[id]
+                        print(id + " disconnected")
+                    if action == "600":
+                        self.clients[id] = websocket
+                        await self.sendmsg(id, "600_1")
+                        print(id + " reconnected")
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            # 连接断开后不再保留该客户端的socket，重连时会重新登记
+            if client_id is not None and self.clients.get(client_id) is websocket:
+                del self.clients[client_id]
+
+    async def ingest_worker(self):
+        """从写入队列取出若干批次，合并为一次SQLite事务写入，成功后逐批回复确认"""
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.ingest_queue.get()]
+            while len(items) < self.flush_batches and not self.ingest_queue.empty():
+                items.append(self.ingest_queue.get_nowait())
+            received_at = time.time()
+            rows = [DetectionStore.to_row(client_id, seq, obj, received_at, epoch, item_seq)
+                    for client_id, seq, data, epoch, item_seqs, _ in items for obj, item_seq in zip(data, item_seqs)]
+            try:
+                start = time.perf_counter()
+                stored = await loop.run_in_executor(self.store_executor, self.store.insert_many, rows)
+                metrics.observe_stage("store_insert", time.perf_counter() - start)
+            except Exception as e:
+                # 写入失败不回复确认，客户端会在重连后重发
+                print(f"写入检测结果失败: {e}")
+            else:
+                metrics.ITEMS.labels("detections_stored").inc(stored)
+                metrics.ITEMS.labels("detections_duplicate").inc(len(rows) - stored)
+                start = time.perf_counter()
+                for client_id, seq, _, _, _, websocket in items:
+                    self.client_metrics(client_id)["stored_batches"] += 1
+                    try:
+                        await websocket.send(json.dumps({"msg": "700_1", "client_id": client_id, "seq": seq}))
+                    except websockets.ConnectionClosed:
+                        pass
+                metrics.observe_stage("ack_send", time.perf_counter() - start)
+            for _ in items:
+                self.ingest_queue.task_done()
 
+    def stats_snapshot(self):
+        return {
+            "connected": len(self.clients),
+            "ingest_queue": self.ingest_queue.qsize(),
+            "metrics": {client_id: dict(m) for client_id, m in self.metrics.items()},
+        }
+
+    async def report_stats(self):
+        """定期打印汇总统计，代替逐条消息打印；多进程模式下上报给supervisor"""
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            if self.stats_sink is not None:
+                self.stats_sink.put((self.worker_id, self.stats_snapshot()))
+                continue
+            detections = sum(m["detections"] for m in self.metrics.values())
+            print(f"clients: {len(self.clients)} connected, {len(self.metrics)} seen; "
+                  f"detections: {detections}; ingest queue: {self.ingest_queue.qsize()}")
 
     async def sendmsg(self, client_id, msg):
         # if(websocket in clients):
@@ -43,6 +171,26 @@ class wsSocket:
         print("Sending " + msg + " to " + client_id)
         await websocket.send(json_data)
 
+    def stop(self):
+        """停止接受新数据，start_ws_server写完队列中已收到的批次后返回"""
+        self.stop_event.set()
+
     async def start_ws_server(self):
-        async with websockets.serve(self.ws_handle, "0.0.0.0", self.port):
-            await asyncio.Future()
+        # 队列和事件需要在事件循环中创建
+        self.ingest_queue = asyncio.Queue(maxsize=self.ingest_queue_size)
+        self.stop_event = asyncio.Event()
+        metrics.QUEUE_DEPTH.set_function(self.ingest_queue.qsize, "ingest")
+        metrics.QUEUE_DEPTH.set_function(lambda: len(self.clients), "connected_clients")
+        workers = [asyncio.create_task(self.ingest_worker()) for _ in range(self.num_workers)]
+        if self.stats_interval is not None:
+            workers.append(asyncio.create_task(self.report_stats()))
+        try:
+            async with websockets.serve(self.ws_handle, "0.0.0.0", self.port, reuse_port=self.reuse_port):
+                await self.stop_event.wait()
+            # 连接已关闭，把已收到的批次写完再退出；来不及回复的确认由客户端重发
+            await self.ingest_queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.store_executor.shutdown(wait=True)
+            self.store.close()
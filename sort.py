@@ -18,30 +18,40 @@
 from __future__ import print_function
 
 import os
-import numpy as np
-import matplotlib
-matplotlib.use('TkAgg')
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from skimage import io
+from collections import deque
 
-import glob
-import time
-import argparse
-from filterpy.kalman import KalmanFilter
+import numpy as np
 
 np.random.seed(0)
 
 
-def linear_assignment(cost_matrix):
+def _load_linear_assignment():
+  """
+  Picks the assignment backend: lap if installed, otherwise scipy.optimize.
+  """
   try:
     import lap
-    _, x, y = lap.lapjv(cost_matrix, extend_cost=True)
-    return np.array([[y[i],i] for i in x if i >= 0]) #
   except ImportError:
     from scipy.optimize import linear_sum_assignment
-    x, y = linear_sum_assignment(cost_matrix)
-    return np.array(list(zip(x, y)))
+    def solve(cost_matrix):
+      x, y = linear_sum_assignment(cost_matrix)
+      return np.array(list(zip(x, y)))
+    return solve
+  def solve(cost_matrix):
+    _, x, y = lap.lapjv(cost_matrix, extend_cost=True)
+    return np.array([[y[i],i] for i in x if i >= 0]) #
+  return solve
+
+
+_solve_assignment = None
+
+
+def linear_assignment(cost_matrix):
+  # the backend is imported on the first call and cached, so importing sort stays cheap
+  global _solve_assignment
+  if _solve_assignment is None:
+    _solve_assignment = _load_linear_assignment()
+  return _solve_assignment(cost_matrix)
 
 
 def iou_batch(bb_test, bb_gt):
@@ -91,15 +101,42 @@ def convert_x_to_bbox(x,score=None):
     return np.array([x[0]-w/2.,x[1]-h/2.,x[0]+w/2.,x[1]+h/2.,score]).reshape((1,5))
 
 
+def convert_bboxes_to_z(bboxes):
+  """
+  Vectorized convert_bbox_to_z: takes an (N,4+) array of [x1,y1,x2,y2] boxes and returns
+    an (N,4) array of [x,y,s,r]
+  """
+  w = bboxes[:, 2] - bboxes[:, 0]
+  h = bboxes[:, 3] - bboxes[:, 1]
+  return np.stack((bboxes[:, 0] + w/2., bboxes[:, 1] + h/2., w * h, w / h), axis=1)
+
+
+def convert_x_to_bboxes(x):
+  """
+  Vectorized convert_x_to_bbox: takes an (N,4+) array of [x,y,s,r] states and returns
+    an (N,4) array of [x1,y1,x2,y2] boxes
+  """
+  with np.errstate(invalid='ignore', divide='ignore'):
+    w = np.sqrt(x[:, 2] * x[:, 3])
+    h = x[:, 2] / w
+  return np.stack((x[:, 0]-w/2., x[:, 1]-h/2., x[:, 0]+w/2., x[:, 1]+h/2.), axis=1)
+
+
 class KalmanBoxTracker(object):
   """
   This class represents the internal state of individual tracked objects observed as bbox.
+  history keeps at most max_history predicted boxes since the last update, so a coasting track
+    does not grow without bound.
   """
+  __slots__ = ('kf', 'time_since_update', 'id', 'history', 'hits', 'hit_streak', 'age')
   count = 0
+  max_history = 30
   def __init__(self,bbox):
     """
     Initialises a tracker using initial bounding box.
     """
+    # filterpy pulls in scipy.stats (~0.7s); Sort itself uses KalmanBoxBatch, so import only when needed
+    from filterpy.kalman import KalmanFilter
     #define constant velocity model
     self.kf = KalmanFilter(dim_x=7, dim_z=4) 
     self.kf.F = np.array([[1,0,0,0,1,0,0],[0,1,0,0,0,1,0],[0,0,1,0,0,0,1],[0,0,0,1,0,0,0],  [0,0,0,0,1,0,0],[0,0,0,0,0,1,0],[0,0,0,0,0,0,1]])
@@ -115,7 +152,7 @@ class KalmanBoxTracker(object):
     self.time_since_update = 0
     self.id = KalmanBoxTracker.count
     KalmanBoxTracker.count += 1
-    self.history = []
+    self.history = deque(maxlen=self.max_history)
     self.hits = 0
     self.hit_streak = 0
     self.age = 0
@@ -125,7 +162,7 @@ class KalmanBoxTracker(object):
     Updates the state vector with observed bbox.
     """
     self.time_since_update = 0
-    self.history = []
+    self.history.clear()
     self.hits += 1
     self.hit_streak += 1
     self.kf.update(convert_bbox_to_z(bbox))
@@ -151,109 +188,568 @@ class KalmanBoxTracker(object):
     return convert_x_to_bbox(self.kf.x)
 
 
-def associate_detections_to_trackers(detections,trackers,iou_threshold = 0.3):
+def iou_pairs(bb_test, bb_gt, test_idx, gt_idx):
+  """
+  Computes IOU only for the given pairs of bboxes in the form [x1,y1,x2,y2]
+  """
+  bb_test = bb_test[test_idx]
+  bb_gt = bb_gt[gt_idx]
+  w = np.maximum(0., np.minimum(bb_test[:, 2], bb_gt[:, 2]) - np.maximum(bb_test[:, 0], bb_gt[:, 0]))
+  h = np.maximum(0., np.minimum(bb_test[:, 3], bb_gt[:, 3]) - np.maximum(bb_test[:, 1], bb_gt[:, 1]))
+  wh = w * h
+  return wh / ((bb_test[:, 2] - bb_test[:, 0]) * (bb_test[:, 3] - bb_test[:, 1])
+    + (bb_gt[:, 2] - bb_gt[:, 0]) * (bb_gt[:, 3] - bb_gt[:, 1]) - wh)
+
+
+def candidate_pairs(bb_test, bb_gt):
+  """
+  Uniform-grid spatial index: returns the index pairs (test, gt) of bboxes that overlap.
+  Every box is registered in the grid cells it covers and only boxes sharing a cell are
+    compared, so on wide-area footage the cost grows with the number of overlaps instead
+    of len(bb_test) * len(bb_gt).
+  """
+  boxes = np.concatenate((bb_test[:, :4], bb_gt[:, :4]))
+  extent = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+  # cells twice the typical box size: most boxes cover 1-4 cells, a few large ones cover more
+  cell = max(2. * np.median(extent), 1e-6)
+  x0 = np.floor(boxes[:, 0] / cell).astype(np.int64)
+  y0 = np.floor(boxes[:, 1] / cell).astype(np.int64)
+  nx = np.floor(boxes[:, 2] / cell).astype(np.int64) - x0 + 1
+  ny = np.floor(boxes[:, 3] / cell).astype(np.int64) - y0 + 1
+  counts = nx * ny
+  owner = np.repeat(np.arange(len(boxes)), counts)
+  offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+  cx = x0[owner] + offset % nx[owner] - x0.min()
+  cy = y0[owner] + offset // nx[owner] - y0.min()
+  keys = cx * (cy.max() + 1) + cy
+
+  is_test = owner < len(bb_test)
+  test_keys, test_owner = keys[is_test], owner[is_test]
+  order = np.argsort(keys[~is_test], kind='stable')
+  gt_keys, gt_owner = keys[~is_test][order], owner[~is_test][order] - len(bb_test)
+  # every (test, gt) entry pair that shares a cell key
+  lo = np.searchsorted(gt_keys, test_keys, side='left')
+  hi = np.searchsorted(gt_keys, test_keys, side='right')
+  hits = hi - lo
+  test_idx = np.repeat(test_owner, hits)
+  gt_pos = np.arange(hits.sum()) - np.repeat(np.cumsum(hits) - hits, hits) + np.repeat(lo, hits)
+  gt_idx = gt_owner[gt_pos]
+  # boxes spanning several shared cells appear more than once
+  pair_code = np.unique(test_idx * len(bb_gt) + gt_idx)
+  return pair_code // len(bb_gt), pair_code % len(bb_gt)
+
+
+def match_components(iou_graph):
+  """
+  Solves the assignment separately on each connected component of the bipartite graph given
+    as a sparse (detections x trackers) matrix of the IOUs of all overlapping pairs.
+  A single linear_assignment over every detection and tracker splits exactly along these
+    components (pairs with no overlap add nothing to the total IOU), so this finds the same
+    pairs, including the ones below the IOU threshold that steer the solution.
+  One-to-one components (the common case) are matched in a single vectorised step, and only
+    contested clusters go to linear_assignment on their own sub-matrix, filled from the COO
+    arrays of the graph.
+
+  Returns an (K,2) int array of [detection, tracker] index pairs and the (K,) IOUs of the pairs
+  """
+  from scipy.sparse import coo_matrix
+  from scipy.sparse.csgraph import connected_components
+  num_dets, num_trks = iou_graph.shape
+  det_idx, trk_idx = iou_graph.row, iou_graph.col
+  if len(det_idx) == 0:
+    return np.empty((0,2),dtype=int), np.empty(0)
+  graph = coo_matrix((np.ones(len(det_idx), dtype=bool), (det_idx, num_dets + trk_idx)),
+                     shape=(num_dets + num_trks, num_dets + num_trks))
+  num_labels, labels = connected_components(graph, directed=False)
+  det_labels = labels[:num_dets]
+  trk_labels = labels[num_dets:]
+  dets_per_label = np.bincount(det_labels, minlength=num_labels)
+  trks_per_label = np.bincount(trk_labels, minlength=num_labels)
+
+  # for one-to-one components the only detection/tracker/pair of each label is its match
+  edge_labels = det_labels[det_idx]
+  det_of_label = np.empty(num_labels, dtype=int)
+  det_of_label[det_labels] = np.arange(num_dets)
+  trk_of_label = np.empty(num_labels, dtype=int)
+  trk_of_label[trk_labels] = np.arange(num_trks)
+  iou_of_label = np.empty(num_labels)
+  iou_of_label[edge_labels] = iou_graph.data
+  one_to_one = (dets_per_label == 1) & (trks_per_label == 1)
+  matched = [np.stack((det_of_label[one_to_one], trk_of_label[one_to_one]), axis=1)]
+  matched_ious = [iou_of_label[one_to_one]]
+
+  contested = (dets_per_label >= 1) & (trks_per_label >= 1) & ~one_to_one
+  if contested.any():
+    # group the detections, trackers and pairs of every contested component without a per-label
+    #   scan, and give each detection/tracker its row/column in the sub-matrix of its component
+    dets = np.flatnonzero(contested[det_labels])
+    dets = dets[np.argsort(det_labels[dets], kind='stable')]
+    trks = np.flatnonzero(contested[trk_labels])
+    trks = trks[np.argsort(trk_labels[trks], kind='stable')]
+    det_counts = dets_per_label[contested]
+    trk_counts = trks_per_label[contested]
+    det_pos = np.empty(num_dets, dtype=int)
+    det_pos[dets] = np.arange(len(dets)) - np.repeat(np.cumsum(det_counts) - det_counts, det_counts)
+    trk_pos = np.empty(num_trks, dtype=int)
+    trk_pos[trks] = np.arange(len(trks)) - np.repeat(np.cumsum(trk_counts) - trk_counts, trk_counts)
+    edges = np.flatnonzero(contested[edge_labels])
+    edges = edges[np.argsort(edge_labels[edges], kind='stable')]
+    edge_counts = np.bincount(edge_labels[edges], minlength=num_labels)[contested]
+    rows, cols, data = det_pos[det_idx[edges]], trk_pos[trk_idx[edges]], iou_graph.data[edges]
+    det_groups = np.split(dets, np.cumsum(det_counts)[:-1])
+    trk_groups = np.split(trks, np.cumsum(trk_counts)[:-1])
+    edge_ends = np.cumsum(edge_counts)
+    for ds, ts, end, count in zip(det_groups, trk_groups, edge_ends, edge_counts):
+      sub = np.zeros((len(ds), len(ts)))
+      sub[rows[end - count:end], cols[end - count:end]] = data[end - count:end]
+      if len(ds) == 1:
+        pairs = np.array([[0, np.argmax(sub[0])]])
+      elif len(ts) == 1:
+        pairs = np.array([[np.argmax(sub[:, 0]), 0]])
+      else:
+        pairs = linear_assignment(-sub).reshape(-1, 2)
+      matched.append(np.stack((ds[pairs[:, 0]], ts[pairs[:, 1]]), axis=1))
+      matched_ious.append(sub[pairs[:, 0], pairs[:, 1]])
+  return np.concatenate(matched, axis=0).astype(int), np.concatenate(matched_ious)
+
+
+def original_detection_order(unmatched_detections, residual_ious):
+  """
+  Orders the unmatched detections as the original single linear_assignment over all pairs did:
+    the detections it left without a tracker come first, followed by those it paired with a
+    tracker below the IOU threshold.
+  residual_ious is the (unmatched detections x unmatched trackers) IOU matrix. The pairs it
+    leaves out of the matching with no overlap at all are decided by the solver's tie-breaking,
+    so they are solved again here rather than assumed to follow index order.
+  """
+  pairs = linear_assignment(-residual_ious).reshape(-1, 2)
+  paired = np.zeros(len(unmatched_detections), dtype=bool)
+  paired[pairs[:, 0]] = True
+  return np.concatenate((unmatched_detections[~paired], unmatched_detections[paired]))
+
+
+def associate_detections_to_trackers(detections,trackers,iou_threshold = 0.3,spatial_index = False):
   """
   Assigns detections to tracked object (both represented as bounding boxes)
+  With spatial_index, IOU is only computed for the overlapping pairs found by candidate_pairs
+    instead of the full detections x trackers matrix.
 
   Returns 3 lists of matches, unmatched_detections and unmatched_trackers
   """
   if(len(trackers)==0):
     return np.empty((0,2),dtype=int), np.arange(len(detections)), np.empty((0,5),dtype=int)
-
-  iou_matrix = iou_batch(detections, trackers)
-
-  if min(iou_matrix.shape) > 0:
-    a = (iou_matrix > iou_threshold).astype(np.int32)
-    if a.sum(1).max() == 1 and a.sum(0).max() == 1:
-        matched_indices = np.stack(np.where(a), axis=1)
-    else:
-      matched_indices = linear_assignment(-iou_matrix)
+  # scipy.sparse is only needed once there are tracks to associate
+  from scipy.sparse import coo_matrix
+
+  if len(detections) == 0:
+    det_idx = trk_idx = np.empty(0, dtype=int)
+    ious = np.empty(0)
+  elif spatial_index:
+    det_idx, trk_idx = candidate_pairs(detections, trackers)
+    ious = iou_pairs(detections, trackers, det_idx, trk_idx)
   else:
-    matched_indices = np.empty(shape=(0,2))
-
-  unmatched_detections = []
-  for d, det in enumerate(detections):
-    if(d not in matched_indices[:,0]):
-      unmatched_detections.append(d)
-  unmatched_trackers = []
-  for t, trk in enumerate(trackers):
-    if(t not in matched_indices[:,1]):
-      unmatched_trackers.append(t)
-
-  #filter out matched with low IOU
-  matches = []
-  for m in matched_indices:
-    if(iou_matrix[m[0], m[1]]<iou_threshold):
-      unmatched_detections.append(m[0])
-      unmatched_trackers.append(m[1])
-    else:
-      matches.append(m.reshape(1,2))
-  if(len(matches)==0):
-    matches = np.empty((0,2),dtype=int)
+    iou_matrix = iou_batch(detections, trackers)
+    det_idx, trk_idx = np.nonzero(iou_matrix)
+    ious = iou_matrix[det_idx, trk_idx]
+  # boxes that merely touch have no overlap, so both paths see the same graph
+  overlapping = ious > 0
+  det_idx, trk_idx, ious = det_idx[overlapping], trk_idx[overlapping], ious[overlapping]
+
+  above = ious > iou_threshold
+  direct = above.any() and np.bincount(det_idx[above]).max() == 1 and np.bincount(trk_idx[above]).max() == 1
+  if direct:
+    # as in the original SORT, a one-to-one set of pairs above the threshold is taken directly
+    matches = np.stack((det_idx[above], trk_idx[above]), axis=1)
   else:
-    matches = np.concatenate(matches,axis=0)
+    iou_graph = coo_matrix((ious, (det_idx, trk_idx)), shape=(len(detections), len(trackers)))
+    pairs, pair_ious = match_components(iou_graph)
+    # filter out matched with low IOU
+    matches = pairs[pair_ious >= iou_threshold]
+
+  unmatched_detections = np.ones(len(detections), dtype=bool)
+  unmatched_detections[matches[:,0]] = False
+  unmatched_detections = np.flatnonzero(unmatched_detections)
+  unmatched_trackers = np.ones(len(trackers), dtype=bool)
+  unmatched_trackers[matches[:,1]] = False
+  unmatched_trackers = np.flatnonzero(unmatched_trackers)
+
+  # new tracks take their ids in the order of the unmatched detections; the original global
+  #   assignment put the detections it left without any tracker before those it paired below
+  #   the threshold, which only differs from index order when trackers were left to pair with
+  if not direct and 0 < len(unmatched_trackers) < len(unmatched_detections):
+    residual = coo_matrix((ious, (det_idx, trk_idx)), shape=(len(detections), len(trackers))).tocsr()
+    residual = residual[unmatched_detections][:, unmatched_trackers].toarray()
+    unmatched_detections = original_detection_order(unmatched_detections, residual)
+
+  return matches, unmatched_detections, unmatched_trackers
+
+
+def _live(name):
+  """
+  Property exposing the live part (first n slots) of a preallocated KalmanBoxBatch array as a view.
+  """
+  return property(lambda self: self._store[name][:self.n])
 
-  return matches, np.array(unmatched_detections), np.array(unmatched_trackers)
+
+class KalmanBoxBatch(object):
+  """
+  Structure-of-arrays version of KalmanBoxTracker: the state of every tracked object lives in
+    shared arrays (means in x, covariances in P) so predict/update run once for all tracks.
+  The arrays are preallocated and only grow (doubling) when more tracks are alive than ever
+    before; removed tracks free their slots for new ones, so a long-running stream allocates
+    no new track storage once it has seen its peak number of objects.
+  """
+  count = 0
+  F = np.array([[1,0,0,0,1,0,0],[0,1,0,0,0,1,0],[0,0,1,0,0,0,1],[0,0,0,1,0,0,0],  [0,0,0,0,1,0,0],[0,0,0,0,0,1,0],[0,0,0,0,0,0,1]], dtype=float)
+  H = np.array([[1,0,0,0,0,0,0],[0,1,0,0,0,0,0],[0,0,1,0,0,0,0],[0,0,0,1,0,0,0]], dtype=float)
+  R = np.diag([1., 1., 10., 10.])
+  Q = np.diag([1., 1., 1., 1., 0.01, 0.01, 0.0001])
+  P0 = np.diag([10., 10., 10., 10., 10000., 10000., 10000.])
+  # per-track fields: name -> (shape of one entry, dtype)
+  FIELDS = {
+    'x': ((7,), float),
+    'P': ((7, 7), float),
+    'id': ((), np.int64),
+    'time_since_update': ((), np.int64),
+    'hits': ((), np.int64),
+    'hit_streak': ((), np.int64),
+    'age': ((), np.int64),
+    'votes': ((0,), float), # confidence-weighted class histogram, widened as new class ids appear
+    # reporting streak: consecutive frames the track has been reported, and where/when it started
+    'reported': ((), np.int64),
+    'first_frame': ((), np.int64),
+    'first_seen': ((), float),
+    'last_seen': ((), float),
+    'first_box': ((4,), float),
+    'last_box': ((4,), float),
+    'confirmed': ((), bool), # set once the track has been confirmed by the caller, see Sort.confirm()
+  }
+  x = _live('x')
+  P = _live('P')
+  id = _live('id')
+  time_since_update = _live('time_since_update')
+  hits = _live('hits')
+  hit_streak = _live('hit_streak')
+  age = _live('age')
+  votes = _live('votes')
+  reported = _live('reported')
+  first_frame = _live('first_frame')
+  first_seen = _live('first_seen')
+  last_seen = _live('last_seen')
+  first_box = _live('first_box')
+  last_box = _live('last_box')
+  confirmed = _live('confirmed')
+
+  def __init__(self, capacity=32):
+    """
+    Creates an empty batch with storage preallocated for capacity tracks.
+    """
+    self.n = 0
+    self._store = {name: np.zeros((capacity,) + shape, dtype=dtype) for name, (shape, dtype) in self.FIELDS.items()}
+
+  def __len__(self):
+    return self.n
+
+  @property
+  def capacity(self):
+    return len(self._store['x'])
+
+  def _reserve(self, n):
+    """
+    Grows the storage (at least doubling it) so that it holds n tracks.
+    """
+    if n <= self.capacity:
+      return
+    capacity = max(n, 2 * self.capacity)
+    for name, old in self._store.items():
+      arr = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+      arr[:self.n] = old[:self.n]
+      self._store[name] = arr
+
+  def _reserve_classes(self, num_classes):
+    """
+    Widens the class histograms so that class ids below num_classes can be counted.
+    """
+    old = self._store['votes']
+    if num_classes <= old.shape[1]:
+      return
+    arr = np.zeros((len(old), num_classes))
+    arr[:, :old.shape[1]] = old
+    self._store['votes'] = arr
+
+  def add(self, bboxes, classes=None, scores=None):
+    """
+    Initialises one new track per bounding box, placed after the existing tracks.
+    classes/scores optionally start each track's class histogram.
+    """
+    k = len(bboxes)
+    if k == 0:
+      return
+    self._reserve(self.n + k)
+    new = slice(self.n, self.n + k)
+    store = self._store
+    for arr in store.values():
+      arr[new] = 0
+    store['x'][new, :4] = convert_bboxes_to_z(bboxes)
+    store['P'][new] = self.P0
+    store['id'][new] = np.arange(KalmanBoxBatch.count, KalmanBoxBatch.count + k)
+    KalmanBoxBatch.count += k
+    self.n += k
+    if classes is not None:
+      self.vote(np.arange(self.n - k, self.n), classes, scores)
+
+  def remove(self, mask):
+    """
+    Drops the tracks selected by the boolean mask, keeping the order of the others.
+    The survivors are compacted in place to the front of the storage.
+    """
+    keep = np.flatnonzero(~mask)
+    for arr in self._store.values():
+      arr[:len(keep)] = arr[keep]
+    self.n = len(keep)
+
+  def predict(self, coast=False):
+    """
+    Advances every state vector and returns the predicted bounding boxes as an (N,4) array.
+    With coast=True the frame is not counted as a missed observation (the detector was skipped).
+    x = F x and P = F P F' + Q are applied in place: F only adds the velocities (rows 4-6) to
+      the first three state components, so no temporaries are allocated.
+    """
+    x = self.x
+    P = self.P
+    x[(x[:, 6] + x[:, 2]) <= 0, 6] = 0.
+    x[:, :3] += x[:, 4:]
+    P[:, :3, :] += P[:, 4:, :]
+    P[:, :, :3] += P[:, :, 4:]
+    P += self.Q
+    self.age[:] += 1
+    if not coast:
+      self.hit_streak[self.time_since_update > 0] = 0
+      self.time_since_update[:] += 1
+    return self.get_state()
+
+  def update(self, idx, bboxes):
+    """
+    Updates the state vectors of the tracks at positions idx with their observed bboxes.
+    """
+    if len(idx) == 0:
+      return
+    self.time_since_update[idx] = 0
+    self.hits[idx] += 1
+    self.hit_streak[idx] += 1
+    x = self.x[idx]
+    P = self.P[idx]
+    y = convert_bboxes_to_z(bboxes) - np.einsum('ij,nj->ni', self.H, x)
+    PHT = np.einsum('nij,kj->nik', P, self.H)
+    S = np.einsum('ij,njk->nik', self.H, PHT) + self.R
+    K = np.einsum('nij,njk->nik', PHT, np.linalg.inv(S))
+    x = x + np.einsum('nij,nj->ni', K, y)
+    I_KH = np.eye(7) - np.einsum('nij,jk->nik', K, self.H)
+    P = np.einsum('nij,njk,nlk->nil', I_KH, P, I_KH) + np.einsum('nij,jk,nlk->nil', K, self.R, K)
+    self.x[idx] = x
+    self.P[idx] = P
+
+  def get_state(self):
+    """
+    Returns the current bounding box estimates as an (N,4) array.
+    """
+    return convert_x_to_bboxes(self.x)
+
+  def vote(self, idx, classes, scores=None):
+    """
+    Adds the detection confidences (1 each if scores is None) to the class histograms of the
+    tracks at positions idx. idx must not contain duplicates; negative classes are ignored.
+    """
+    classes = np.asarray(classes).astype(np.int64)
+    valid = classes >= 0
+    if not valid.any():
+      return
+    idx, classes = np.asarray(idx)[valid], classes[valid]
+    self._reserve_classes(classes.max() + 1)
+    self.votes[idx, classes] += 1. if scores is None else np.asarray(scores)[valid]
+
+  def classes(self):
+    """
+    Returns the majority class of every track (argmax of its histogram), -1 if it has no votes.
+    """
+    votes = self.votes
+    if votes.shape[1] == 0:
+      return np.full(len(votes), -1.)
+    return np.where(votes.any(axis=1), votes.argmax(axis=1), -1).astype(float)
 
 
 class Sort(object):
-  def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3):
+  def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3, spatial_index=False):
     """
     Sets key parameters for SORT
+    spatial_index: only compute IOU for overlapping pairs found with a uniform grid
+      (for scenes with hundreds or thousands of objects)
     """
     self.max_age = max_age
     self.min_hits = min_hits
     self.iou_threshold = iou_threshold
-    self.trackers = []
+    self.spatial_index = spatial_index
+    self.trackers = KalmanBoxBatch()
     self.frame_count = 0
-
-  def update(self, dets=np.empty((0, 5))):
+    self.with_classes = False
+    self.frame_index = 0 # frames seen by update() and coast()
+    # reporting streak of each row returned by the last update()/coast()
+    self.streaks = np.zeros(0, dtype=np.int64)
+    # tracks whose reporting streak ended on the last frame (see _end_streaks), or None
+    self.ended = None
+
+  def update(self, dets=np.empty((0, 5)), now=None):
     """
     Params:
       dets - a numpy array of detections in the format [[x1,y1,x2,y2,score],[x1,y1,x2,y2,score],...]
+        optionally with a sixth class column [[x1,y1,x2,y2,score,class],...]
     Requires: this method must be called once for each frame even with empty detections (use np.empty((0, 5)) for frames without detections).
-    Returns the a similar array, where the last column is the object ID.
+    Returns the a similar array, where the fifth column is the object ID. When the detections carry
+      a class column, a sixth column holds the track's majority class: the argmax of the
+      confidence-weighted histogram of the classes of all detections associated with it.
+
+    now - optional timestamp of the frame (e.g. time.time()) recorded in the streak summaries;
+      defaults to the frame index.
+    After the call, self.streaks holds the number of consecutive frames each returned track has
+      been reported and self.ended the summaries of the streaks that ended on this frame.
 
     NOTE: The number of objects returned may differ from the number of detections provided.
     """
     self.frame_count += 1
+    self.frame_index += 1
+    self.ended = None
+    dets = np.asarray(dets, dtype=float)
+    if dets.ndim != 2:
+      dets = dets.reshape(-1, 6 if self.with_classes else 5)
+    self.with_classes = dets.shape[1] > 5
     # get predicted locations from existing trackers.
-    trks = np.zeros((len(self.trackers), 5))
-    to_del = []
-    ret = []
-    for t, trk in enumerate(trks):
-      pos = self.trackers[t].predict()[0]
-      trk[:] = [pos[0], pos[1], pos[2], pos[3], 0]
-      if np.any(np.isnan(pos)):
-        to_del.append(t)
-    trks = np.ma.compress_rows(np.ma.masked_invalid(trks))
-    for t in reversed(to_del):
-      self.trackers.pop(t)
-    matched, unmatched_dets, unmatched_trks = associate_detections_to_trackers(dets,trks, self.iou_threshold)
+    trks = self.trackers.predict()
+    invalid = np.any(np.isnan(trks), axis=1)
+    if invalid.any():
+      self._end_streaks(invalid & (self.trackers.reported > 0))
+      self.trackers.remove(invalid)
+      trks = trks[~invalid]
+    matched, unmatched_dets, unmatched_trks = associate_detections_to_trackers(dets,trks, self.iou_threshold, self.spatial_index)
 
     # update matched trackers with assigned detections
-    for m in matched:
-      self.trackers[m[1]].update(dets[m[0], :])
+    self.trackers.update(matched[:, 1], dets[matched[:, 0], :4])
+    if self.with_classes:
+      self.trackers.vote(matched[:, 1], dets[matched[:, 0], 5], dets[matched[:, 0], 4])
 
     # create and initialise new trackers for unmatched detections
-    for i in unmatched_dets:
-        trk = KalmanBoxTracker(dets[i,:])
-        self.trackers.append(trk)
-    i = len(self.trackers)
-    for trk in reversed(self.trackers):
-        d = trk.get_state()[0]
-        if (trk.time_since_update < 1) and (trk.hit_streak >= self.min_hits or self.frame_count <= self.min_hits):
-          ret.append(np.concatenate((d,[trk.id+1])).reshape(1,-1)) # +1 as MOT benchmark requires positive
-        i -= 1
-        # remove dead tracklet
-        if(trk.time_since_update > self.max_age):
-          self.trackers.pop(i)
+    unmatched_dets = unmatched_dets.astype(int)
+    if self.with_classes:
+      self.trackers.add(dets[unmatched_dets, :4], dets[unmatched_dets, 5], dets[unmatched_dets, 4])
+    else:
+      self.trackers.add(dets[unmatched_dets, :4])
+
+    ret = self._reported(now)
+    # remove dead tracklet
+    dead = self.trackers.time_since_update > self.max_age
+    if dead.any():
+      self.trackers.remove(dead)
+    return ret
+
+  def coast(self, now=None):
+    """
+    Advances all tracks by one frame on which the detector was skipped (detect-every-K mode).
+    Unlike update() with no detections, no track is counted as missed, so tracks keep their
+    hit streak and are not removed.
+    Returns the same format as update().
+    """
+    self.frame_index += 1
+    self.ended = None
+    trks = self.trackers.predict(coast=True)
+    invalid = np.any(np.isnan(trks), axis=1)
+    if invalid.any():
+      self._end_streaks(invalid & (self.trackers.reported > 0))
+      self.trackers.remove(invalid)
+    return self._reported(now)
+
+  def flush(self):
+    """
+    Ends the reporting streak of every track (e.g. at the end of the stream).
+    Returns the summaries, in the format of self.ended.
+    """
+    self.ended = None
+    self._end_streaks(self.trackers.reported > 0)
+    return self.ended
+
+  def _end_streaks(self, mask):
+    """
+    Records in self.ended a summary of the reporting streaks of the tracks selected by mask, and
+    resets them. self.ended is a dict of arrays: id, age (frames in the streak), first_frame,
+    first_seen, last_seen, first_box, last_box and cls (majority class, -1 if unknown).
+    """
+    if not mask.any():
+      return
+    trk = self.trackers
+    ended = {
+      'id': trk.id[mask] + 1,
+      'age': trk.reported[mask],
+      'first_frame': trk.first_frame[mask],
+      'first_seen': trk.first_seen[mask],
+      'last_seen': trk.last_seen[mask],
+      'first_box': trk.first_box[mask],
+      'last_box': trk.last_box[mask],
+      'cls': trk.classes()[mask],
+    }
+    if self.ended is not None:
+      ended = {key: np.concatenate((self.ended[key], value)) for key, value in ended.items()}
+    self.ended = ended
+    trk.reported[mask] = 0
+
+  def confirm(self, ids):
+    """
+    Marks the reported tracks with these ids (as returned by update()) as confirmed.
+    Returns a boolean mask over ids of the tracks that were not confirmed before, so that a
+    track whose reporting streak is interrupted and resumes is only confirmed once.
+    """
+    trk = self.trackers
+    # ids are handed out in increasing order and remove() keeps the order of the survivors
+    idx = np.searchsorted(trk.id, np.asarray(ids, dtype=np.int64) - 1)
+    new = ~trk.confirmed[idx]
+    trk.confirmed[idx] = True
+    return new
+
+  def motion(self):
+    """
+    Returns the per-frame displacement of every track centre relative to its box size (sqrt of
+    the area), as estimated by the Kalman velocities.
+    """
+    x = self.trackers.x
+    with np.errstate(invalid='ignore', divide='ignore'):
+      return np.hypot(x[:, 4], x[:, 5]) / np.sqrt(x[:, 2])
+
+  def _reported(self, now=None):
+    """
+    Returns the tracks reported for the current frame, newest first, and updates the reporting
+    streaks: tracks reported on this frame extend (or start) theirs, the others end.
+    """
+    trk = self.trackers
+    alive = (trk.time_since_update < 1) & ((trk.hit_streak >= self.min_hits) | (self.frame_count <= self.min_hits))
+    state = trk.get_state()
+    self._end_streaks(~alive & (trk.reported > 0))
+    now = self.frame_index if now is None else now
+    started = alive & (trk.reported == 0)
+    trk.first_frame[started] = self.frame_index
+    trk.first_seen[started] = now
+    trk.first_box[started] = state[started]
+    trk.reported[alive] += 1
+    trk.last_seen[alive] = now
+    trk.last_box[alive] = state[alive]
+    self.streaks = trk.reported[alive][::-1]
+    cols = [state, (trk.id + 1)[:, None]] # +1 as MOT benchmark requires positive
+    if self.with_classes:
+      cols.append(trk.classes()[:, None])
+    ret = np.concatenate(cols, axis=1)[alive][::-1]
     if(len(ret)>0):
-      return np.concatenate(ret)
-    return np.empty((0,5))
+      return ret
+    return np.empty((0,6 if self.with_classes else 5))
 
 def parse_args():
     """Parse input arguments."""
+    import argparse
     parser = argparse.ArgumentParser(description='SORT demo')
     parser.add_argument('--display', dest='display', help='Display online tracker output (slow) [False]',action='store_true')
     parser.add_argument("--seq_path", help="Path to detections.", type=str, default='data')
@@ -265,11 +761,14 @@ def parse_args():
                         help="Minimum number of associated detections before track is initialised.", 
                         type=int, default=3)
     parser.add_argument("--iou_threshold", help="Minimum IOU for match.", type=float, default=0.3)
+    parser.add_argument('--spatial_index', dest='spatial_index', help='Use a grid index to only compute IOU for overlapping boxes [False]',action='store_true')
     args = parser.parse_args()
     return args
 
 if __name__ == '__main__':
-  # all train
+  # demo-only dependencies are imported here so that importing Sort stays light and headless-safe
+  import glob
+  import time
   args = parse_args()
   display = args.display
   phase = args.phase
@@ -277,6 +776,11 @@ if __name__ == '__main__':
   total_frames = 0
   colours = np.random.rand(32, 3) #used only for display
   if(display):
+    import matplotlib
+    matplotlib.use('TkAgg')
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as patches
+    from skimage import io
     if not os.path.exists('mot_benchmark'):
       print('\n\tERROR: mot_benchmark link not found!\n\n    Create a symbolic link to the MOT benchmark\n    (https://motchallenge.net/data/2D_MOT_2015/#download). E.g.:\n\n    $ ln -s /path/to/MOT2015_challenge/2DMOT2015 mot_benchmark\n\n')
       exit()
@@ -290,7 +794,8 @@ if __name__ == '__main__':
   for seq_dets_fn in glob.glob(pattern):
     mot_tracker = Sort(max_age=args.max_age, 
                        min_hits=args.min_hits,
-                       iou_threshold=args.iou_threshold) #create instance of the SORT tracker
+                       iou_threshold=args.iou_threshold,
+                       spatial_index=args.spatial_index) #create instance of the SORT tracker
     seq_dets = np.loadtxt(seq_dets_fn, delimiter=',')
     seq = seq_dets_fn[pattern.find('*'):].split(os.path.sep)[0]
     
@@ -1,12 +1,63 @@
 import cv2
-import torch
 import asyncio
-from ultralytics import YOLO
-from sort import Sort
-from deep_sort_realtime.deepsort_tracker import DeepSort
+import os
+import signal
+import time
+import numpy as np
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from tracker_backends import SortBackend, DeepSortBackend
+import detection_cache
+from capture import LiveCapture, is_live_source
+import metrics
+import profiler
+
+# 读取实时视频源时每次最多等待新帧的秒数
+LIVE_READ_TIMEOUT = 0.5
+
+class StreamState:
+    """单路视频流的追踪状态：追踪器、当前帧的稳定轨迹和检测间隔"""
+    def __init__(self, tracker_choice, spatial_index=False, tracker_params=None, names=None):
+        tracker_params = tracker_params or {}
+        if tracker_choice == "sort":
+            self.tracker = SortBackend(spatial_index, **tracker_params)
+        elif tracker_choice == "deep_sort":
+            self.tracker = DeepSortBackend(**tracker_params)
+        self.names = names or {}  # 类别编号 -> 类别名
+        # 当前帧的稳定轨迹（连续出现达到stable_frames_threshold帧）：(ids, boxes, ages, classes)数组
+        self.stable = (np.zeros(0, dtype=np.int64), np.zeros((0, 4), dtype=np.int64),
+                       np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        self._current_detections = None
+        self.detect_interval = 1  # 当前检测间隔K：每K帧运行一次YOLO
+        self.frames_to_detect = 0  # 距离下一次检测还需跳过的帧数
+
+    @property
+    def current_detections(self):
+        """当前帧稳定轨迹的字典列表，第一次访问时才从数组生成"""
+        if self._current_detections is None:
+            self._current_detections = [self.detection(i) for i in range(len(self.stable[0]))]
+        return self._current_detections
+
+    def detection(self, i):
+        ids, boxes, ages, classes = self.stable
+        return {
+            'id': int(ids[i]),
+            'bbox': tuple(boxes[i].tolist()),
+            'age': int(ages[i]),
+            'class': self.class_name(classes[i])
+        }
+
+    def class_name(self, class_id):
+        return self.names[int(class_id)] if class_id != -1 else 'unknown'
+
 
 class Tracker:
-    def __init__(self, model_path="yolov8n.pt", stable_frames_threshold=48, verbose=False, tracker="sort"):
+    def __init__(self, model_path="yolov8n.pt", stable_frames_threshold=48, verbose=False, tracker="sort",
+                 queue_size=4, inference_workers=1, batch_size=1, max_batch_latency=0.05,
+                 detect_interval=1, adaptive_interval=False, motion_tolerance=0.5, spatial_index=False,
+                 tracker_params=None, display=True, output_sink=None, live_capture="auto",
+                 stream_fps=None, profile_dir="profiles", profile_seconds=30, profile_mode="sample"):
         """
         初始化异步对象追踪器
         
@@ -15,153 +66,207 @@ class Tracker:
             stable_frames_threshold: 稳定帧数阈值
             verbose: 是否显示详细输出
             tracker: 选择追踪器类型 ("sort" 或 "deep_sort")
+            queue_size: 流水线各阶段之间队列的最大长度，队列满时上游阶段等待（背压）
+            inference_workers: 推理线程数，即同时进行中的YOLO推理批次数（大于1时每个线程加载一份模型）
+            batch_size: 每次YOLO调用最多合并的帧数，可来自同一视频流或多路视频流
+            max_batch_latency: 凑批最长等待时间(秒)，超时后不满batch_size也立即推理
+            detect_interval: 每K帧运行一次YOLO，中间帧只用卡尔曼预测推进轨迹；
+                adaptive_interval为True时这是K的上限
+            adaptive_interval: 是否根据场景运动速度自动调整K
+            motion_tolerance: 自适应模式下，两次检测之间目标允许移动的最大距离（相对于目标框尺寸）
+            spatial_index: SORT关联时用网格索引只计算互相重叠的框的IoU，适合上千目标的大场景航拍
+            tracker_params: 传给Sort或DeepSort构造函数的参数，如{"max_age": 5, "min_hits": 3}
+            display: 是否用cv2.imshow显示结果；无显示器的边缘节点设为False
+            output_sink: 可选的frame_sink.FrameSink，在后台线程编码输出标注后的帧；
+                display为False且没有output_sink时为无头模式，不在帧上绘制
+            live_capture: 是否用capture.LiveCapture读帧（专用解码线程、总是取最新帧、断流自动重连）；
+                "auto"时摄像头和RTSP等网络流使用，本地视频文件仍逐帧读取不丢帧
+            stream_fps: 每路视频流的最大处理帧率，可以是一个数（所有视频流相同）或{视频流编号: 帧率}；
+                None为不限制
+            profile_dir: 剖析结果的输出目录；运行中向进程发送SIGUSR1或调用start_profiling()开始剖析
+            profile_seconds: 每次剖析的时长(秒)
+            profile_mode: "sample"为所有线程的调用栈采样（火焰图折叠栈），"cprofile"为事件循环线程的cProfile
         """
+        # ultralytics会导入torch，在创建Tracker时才导入，只导入track模块时不加载
+        from ultralytics import YOLO
         self.tracker_choice = tracker
+        self.model_path = model_path
         self.model = YOLO(model_path)
-        if tracker == "sort":
-            self.tracker = Sort()
-        elif tracker == "deep_sort":
-            self.tracker = DeepSort()
+        self.streams = {}  # 视频流编号 -> StreamState
         
         self.stable_frames_threshold = stable_frames_threshold
-        self.tracked_objects_history = {}  # 存储追踪对象的历史信息
-        self.tracked_objects_classes = {}  # 新增：存储追踪对象的类别信息
-        self.current_detections = []
         self.running = False
         self.verbose = verbose
+        self.queue_size = queue_size
+        self.inference_workers = inference_workers
+        self.batch_size = batch_size
+        self.max_batch_latency = max_batch_latency
+        self.detect_interval = detect_interval
+        self.adaptive_interval = adaptive_interval
+        self.motion_tolerance = motion_tolerance
+        self.spatial_index = spatial_index
+        self.tracker_params = tracker_params
+        self.display = display
+        self.output_sink = output_sink
+        # 没有人看结果时跳过所有绘制
+        self.draw = display or output_sink is not None
+        self.live_capture = live_capture
+        self.stream_fps = stream_fps
+        # YOLO推理和cv2读帧都会阻塞，放到线程池中执行，避免卡住事件循环（读帧线程池在track_objects中按视频流数量创建）
+        # (torch和OpenCV在计算时会释放GIL，线程池即可并行，无需进程池复制模型)
+        self.inference_executor = ThreadPoolExecutor(max_workers=inference_workers, thread_name_prefix="yolo")
+        self.capture_executor = None
+        self._thread_models = threading.local()
+        self.profile_dir = profile_dir
+        self.profile_seconds = profile_seconds
+        self.profile_mode = profile_mode
+        self._profile = None
+        self._subscribers = []  # [(事件队列, 视频流编号或None, 事件类型集合)]
+        
+    def stream(self, stream_id=0):
+        """获取视频流的追踪状态，第一次访问时创建"""
+        state = self.streams.get(stream_id)
+        if state is None:
+            state = self.streams[stream_id] = StreamState(self.tracker_choice, self.spatial_index, self.tracker_params,
+                                                          self.model.names)
+            state.detect_interval = self.detect_interval
+        return state
+
+    def _should_detect(self, stream_id):
+        """按视频流的检测间隔K判断这一帧是否需要运行YOLO"""
+        state = self.stream(stream_id)
+        if state.frames_to_detect > 0:
+            state.frames_to_detect -= 1
+            return False
+        state.frames_to_detect = state.detect_interval - 1
+        return True
+
+    def _adapt_interval(self, state):
+        """
+        根据场景运动速度调整检测间隔K：取所有轨迹中最快的目标（每帧位移/目标尺寸），
+        使两次检测之间它的位移不超过motion_tolerance
+        """
+        motion = state.tracker.motion()
+        motion = motion[np.isfinite(motion)]
+        fastest = motion.max() if len(motion) else 0.
+        if fastest * self.detect_interval <= self.motion_tolerance:
+            state.detect_interval = self.detect_interval
+        else:
+            state.detect_interval = max(1, int(self.motion_tolerance / fastest))
+
+    def detect(self, frame):
+        """
+        对单帧或一批帧执行YOLO检测（同步阻塞，在推理线程池中调用）
         
-    async def process_frame(self, frame):
+        参数:
+            frame: 输入视频帧，或多帧组成的列表（一次批量推理）
+            
+        返回:
+            YOLO检测结果列表，每帧一项
+        """
+        # YOLO预测器不是线程安全的，多个推理线程时各自使用独立的模型
+        model = self.model
+        if self.inference_workers > 1:
+            model = getattr(self._thread_models, "model", None)
+            if model is None:
+                model = self._thread_models.model = type(self.model)(self.model_path)
+        # 使用YOLO模型进行预测，设置verbose=False来禁止输出
+        with metrics.time_stage("inference"):
+            return model(frame, verbose=self.verbose)
+
+    async def process_frame(self, frame, stream_id=0):
         """
         异步处理单个帧，执行检测和追踪
         
         参数:
             frame: 输入视频帧
+            stream_id: 视频流编号
             
         返回:
             处理后的帧和检测结果
         """
-        # 使用YOLO模型进行预测，设置verbose=False来禁止输出
-        results = self.model(frame, verbose=self.verbose)
-        
-        # 提取检测框信息
-        detections = []
-        detections_deepsort = []
-        for result in results:
-            for box in result.boxes:
-                x1, y1, x2, y2, conf, cls = box.xyxy[0].tolist() + [box.conf[0].item(), box.cls[0].item()]
-                detections.append([x1, y1, x2, y2, conf])
-                w, h = x2 - x1, y2 - y1
-                class_name = self.model.names[int(cls)]
-                detections_deepsort.append(([x1, y1, w, h], conf, class_name))
-        
-        # 更新追踪器
-        if self.tracker_choice == "sort":
-            # 对于SORT，我们需要在更新追踪器前保存检测结果的类别信息
-            tracked_objects = self.tracker.update(torch.tensor(detections))
-            
-            # 创建一个字典来映射检测框到类别
-            detection_classes = {}
-            for det, box in zip(detections, results[0].boxes):
-                cls = int(box.cls[0].item())
-                detection_classes[tuple(det[:4])] = cls
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(self.inference_executor, self.detect, frame)
+        return self.update_tracks(frame, results[0], stream_id)
+
+    @staticmethod
+    def extract_detections(result):
+        """
+        把YOLO结果一次性转换为(N,6)数组 [x1, y1, x2, y2, conf, cls]
+        
+        直接取result.boxes.data整块拷贝到CPU，不逐个检测框调用.tolist()/.item()，
+        避免每个检测框多次GPU同步和小对象分配
+        
+        参数:
+            result: 单帧YOLO检测结果，为None时返回空数组
+        """
+        if result is None:
+            return np.empty((0, 6))
+        return result.boxes.data.cpu().numpy().astype(float, copy=False)
+
+    def update_tracks(self, frame, result, stream_id=0):
+        """
+        用检测结果更新追踪器、稳定帧计数和当前检测结果，并在帧上绘制
+        
+        参数:
+            frame: 输入视频帧
+            result: 该帧的YOLO检测结果（detect()返回列表中的一项）；为None表示这一帧跳过了检测，
+                只用卡尔曼预测推进轨迹，稳定帧计数照常加一
+            stream_id: 视频流编号，每路视频流有独立的追踪器状态
             
-        elif self.tracker_choice == "deep_sort":
-            tracked_objects = self.tracker.update_tracks(detections_deepsort, frame=frame)
-        
-        # 更新每个对象的ID及其出现的帧数
-        current_frame_ids = set()
-        for obj in tracked_objects:
-            if self.tracker_choice == "sort":
-                obj_id = int(obj[4])
-                current_frame_ids.add(obj_id)
-                
-                # 获取当前追踪对象的边界框
-                x1, y1, x2, y2 = obj[:4]
-                
-                # 找到最匹配的原始检测框以获取类别
-                matched_class = None
-                min_distance = float('inf')
-                
-                for det in detections:
-                    det_x1, det_y1, det_x2, det_y2, _ = det
-                    # 计算IOU或中心点距离
-                    center_x = (x1 + x2) / 2
-                    center_y = (y1 + y2) / 2
-                    det_center_x = (det_x1 + det_x2) / 2
-                    det_center_y = (det_y1 + det_y2) / 2
-                    distance = ((center_x - det_center_x)**2 + (center_y - det_center_y)**2)**0.5
-                    
-                    if distance < min_distance:
-                        min_distance = distance
-                        matched_class = detection_classes.get((det_x1, det_y1, det_x2, det_y2), -1)
-                
-                # 更新或存储类别信息
-                if obj_id in self.tracked_objects_history:
-                    self.tracked_objects_history[obj_id] += 1
-                    # 只有当之前没有类别信息或新检测到的类别可信时才更新
-                    if matched_class != -1 and (obj_id not in self.tracked_objects_classes or self.tracked_objects_history[obj_id] < 5):
-                        self.tracked_objects_classes[obj_id] = matched_class
-                else:
-                    self.tracked_objects_history[obj_id] = 1
-                    if matched_class != -1:
-                        self.tracked_objects_classes[obj_id] = matched_class
-                    
-            elif self.tracker_choice == "deep_sort":
-                obj_id = obj.track_id
-                current_frame_ids.add(obj_id)
-                if obj_id in self.tracked_objects_history:
-                    self.tracked_objects_history[obj_id] += 1
-                else:
-                    self.tracked_objects_history[obj_id] = 1
-        
-        # 移除在当前帧中未出现的对象
-        for obj_id in list(self.tracked_objects_history.keys()):
-            if obj_id not in current_frame_ids:
-                del self.tracked_objects_history[obj_id]
-                if obj_id in self.tracked_objects_classes:
-                    del self.tracked_objects_classes[obj_id]
-        
-        # 存储当前检测结果
-        self.current_detections = []
-        for obj in tracked_objects:
-            if self.tracker_choice == "sort":
-                obj_id = int(obj[4])
-                if self.tracked_objects_history.get(obj_id, 0) >= self.stable_frames_threshold:
-                    x1, y1, x2, y2 = obj[:4].astype(int)
-                    class_id = self.tracked_objects_classes.get(obj_id, -1)
-                    class_name = self.model.names[class_id] if class_id != -1 else 'unknown'
-                    
-                    self.current_detections.append({
-                        'id': obj_id,
-                        'bbox': (x1, y1, x2, y2),
-                        'age': self.tracked_objects_history[obj_id],
-                        'class': class_name
-                    })
-                    
-                    # 绘制追踪结果
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                    cv2.putText(frame, f'ID: {obj_id} {class_name}', (x1, y1 - 10), 
-                              cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+        返回:
+            处理后的帧
+        """
+        detections = self.extract_detections(result) if result is not None else None
+        return self.track_detections(detections, stream_id, frame)
+
+    def track_detections(self, detections, stream_id=0, frame=None):
+        """
+        追踪的后半部分：用(N,6)检测数组更新追踪器、稳定帧计数和当前检测结果
+        
+        参数:
+            detections: extract_detections()格式的检测数组；为None表示这一帧跳过了检测
+            stream_id: 视频流编号
+            frame: 视频帧，为None时不绘制（回放模式）；deep_sort需要用帧提取外观特征，不能为None；
+                无头模式下照常传入，只是不绘制
             
-            elif self.tracker_choice == "deep_sort":
-                obj_id = obj.track_id
-                if self.tracked_objects_history.get(obj_id, 0) >= self.stable_frames_threshold:
-                    bbox = obj.to_ltrb()  # 获取边界框坐标 [left, top, right, bottom]
-                    x1, y1, x2, y2 = map(int, bbox)
-                    class_id = obj.get_det_class() if hasattr(obj, 'get_det_class') else -1
-                    class_name = self.model.names[class_id] if class_id != -1 else 'unknown'
-                    
-                    self.current_detections.append({
-                        'id': obj_id,
-                        'bbox': (x1, y1, x2, y2),
-                        'age': self.tracked_objects_history[obj_id],
-                        'class': class_name
-                    })
-                    
-                    # 绘制追踪结果
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                    cv2.putText(frame, f'ID: {obj_id} {class_name}', (x1, y1 - 10), 
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+        返回:
+            处理后的帧
+        """
+        state = self.stream(stream_id)
+        draw = frame is not None and self.draw
+        
+        # 更新追踪器：跳过检测的帧只做卡尔曼预测，不计为丢失；类别由追踪器在轨迹内部投票
+        start = time.perf_counter()
+        boxes, ids, classes, streaks = state.tracker.step(detections, frame, time.time())
+        metrics.observe_stage("tracker_update", time.perf_counter() - start)
+        metrics.FRAMES.labels(stream_id).inc()
+        metrics.TRACKS.labels(stream_id).set(len(ids))
+        
+        if detections is not None and self.adaptive_interval:
+            self._adapt_interval(state)
+        
+        # 连续出现的帧数由追踪器按轨迹记录，这里只用数组筛选出稳定轨迹，
+        # current_detections等到有人读取时才生成字典
+        start = time.perf_counter()
+        stable = streaks >= self.stable_frames_threshold
+        state.stable = (ids[stable], boxes[stable].astype(np.int64), streaks[stable], classes[stable])
+        state._current_detections = None
+        # 每条轨迹只在第一次变为稳定时确认，连续出现中断后又恢复的轨迹不再确认
+        confirmed = state.tracker.confirm(ids[stable])
+        if self._subscribers:
+            self._emit_track_events(state, stream_id, confirmed)
+        metrics.observe_stage("stability", time.perf_counter() - start)
+        
+        # 绘制追踪结果
+        if draw:
+            start = time.perf_counter()
+            stable_ids, stable_boxes, _, stable_classes = state.stable
+            for obj_id, (x1, y1, x2, y2), class_id in zip(stable_ids.tolist(), stable_boxes.tolist(), stable_classes):
+                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                cv2.putText(frame, f'ID: {obj_id} {state.class_name(class_id)}', (x1, y1 - 10), 
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+            metrics.observe_stage("drawing", time.perf_counter() - start)
         
         return frame
 
@@ -169,33 +274,375 @@ class Tracker:
         """
         异步追踪视频流中的对象
         
+        读帧、推理、追踪三个阶段通过有界队列串联，读帧和推理在线程池中执行，
+        事件循环只负责调度，websocket上传和心跳不会被推理阻塞。
+        推理阶段把最多batch_size帧合并为一次YOLO调用，结果再分发到各视频流自己的追踪器。
+        
         参数:
-            video_source: 视频源(文件路径或摄像头索引)
+            video_source: 视频源(文件路径或摄像头索引)；也可以是多路视频源的列表或
+                {视频流编号: 视频源} 字典，此时所有视频流共用一个模型批量推理
         """
+        if isinstance(video_source, dict):
+            sources = dict(video_source)
+        elif isinstance(video_source, (list, tuple)):
+            sources = dict(enumerate(video_source))
+        else:
+            sources = {0: video_source}
         self.running = True
-        cap = cv2.VideoCapture(video_source)
-        
+        caps = {stream_id: self._open_capture(source) for stream_id, source in sources.items()}
+        # 每路视频流一个读帧线程，保证多路读帧互不阻塞
+        self.capture_executor = ThreadPoolExecutor(max_workers=len(caps), thread_name_prefix="capture")
+        frame_queue = asyncio.Queue(maxsize=self.queue_size * len(caps))
+        # 每路视频流在帧队列中最多占queue_size个位置，繁忙的摄像头不会挤掉其他摄像头
+        self._stream_slots = {stream_id: asyncio.Semaphore(self.queue_size) for stream_id in caps}
+        result_queue = asyncio.Queue(maxsize=self.queue_size)
+        metrics.QUEUE_DEPTH.set_function(frame_queue.qsize, "frame")
+        metrics.QUEUE_DEPTH.set_function(result_queue.qsize, "result")
+        stages = [asyncio.create_task(self._capture_stage(stream_id, cap, frame_queue))
+                  for stream_id, cap in caps.items()]
+        stages += [
+            asyncio.create_task(self._inference_stage(frame_queue, result_queue, len(caps))),
+            asyncio.create_task(self._tracking_stage(result_queue, len(caps) > 1)),
+        ]
+        waiting = set(stages)
+        self._install_profile_signal()
+        try:
+            # 追踪阶段结束（视频读完或按下q）即退出；上游阶段出错时立即抛出异常
+            while stages[-1] in waiting:
+                done, waiting = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                for stage in done:
+                    stage.result()
+        finally:
+            self.running = False
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            # 取消读帧协程不会中断线程中正在执行的cap.read()，先等读帧线程结束再释放视频流；
+            # LiveCapture.read()在没有新帧时一直等待（视频源断开时），先唤醒它
+            for cap in caps.values():
+                if isinstance(cap, LiveCapture):
+                    cap.stop()
+            await asyncio.get_running_loop().run_in_executor(None, self.capture_executor.shutdown, True)
+            for cap in caps.values():
+                cap.release()
+            self._remove_profile_signal()
+            for stream_id in caps:
+                self._end_stream(stream_id)
+            if self.display:
+                cv2.destroyAllWindows()
+
+    def start_profiling(self, seconds=None, mode=None):
+        """
+        对运行中的追踪循环剖析seconds秒，结果写入profile_dir，已有剖析在进行时忽略；
+        需要在事件循环线程中调用（cprofile模式只统计调用线程）
+
+        返回:
+            输出文件路径（不含扩展名），未开始时为None
+        """
+        if self._profile is not None and self._profile.is_alive():
+            print("Profiling already in progress")
+            return None
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, time.strftime("profile_%Y%m%d_%H%M%S"))
+        self._profile = profiler.start(path, seconds or self.profile_seconds, mode or self.profile_mode,
+                                       asyncio.get_running_loop())
+        return path
+
+    def _install_profile_signal(self):
+        """收到SIGUSR1时开始剖析；不支持信号（Windows或非主线程）时只能调用start_profiling()"""
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, self.start_profiling)
+        except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+            pass
+
+    def _remove_profile_signal(self):
+        try:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR1)
+        except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+            pass
+
+    def _open_capture(self, source):
+        """实时视频源用LiveCapture，避免推理慢于摄像头时OpenCV缓冲区里的帧越积越多"""
+        live = is_live_source(source) if self.live_capture == "auto" else self.live_capture
+        return LiveCapture(source) if live else cv2.VideoCapture(source)
+
+    def _max_fps(self, stream_id):
+        if isinstance(self.stream_fps, dict):
+            return self.stream_fps.get(stream_id)
+        return self.stream_fps
+
+    async def _capture_stage(self, stream_id, cap, frame_queue):
+        """读帧阶段：在读帧线程中调用cap.read()，该视频流在队列中的位置用完时等待下游；按stream_fps限速"""
+        loop = asyncio.get_running_loop()
+        max_fps = self._max_fps(stream_id)
+        next_read = loop.time()
         while self.running and cap.isOpened():
-            ret, frame = cap.read()
+            if max_fps:
+                await asyncio.sleep(max(0., next_read - loop.time()))
+                next_read = max(next_read, loop.time()) + 1. / max_fps
+            start = time.perf_counter()
+            if isinstance(cap, LiveCapture):
+                # 视频源断开时LiveCapture没有新帧，限时等待，超时后回到循环开头检查是否已停止追踪
+                ret, frame = await loop.run_in_executor(self.capture_executor, cap.read, LIVE_READ_TIMEOUT)
+                if not ret and cap.isOpened():
+                    continue
+            else:
+                ret, frame = await loop.run_in_executor(self.capture_executor, cap.read)
+            metrics.observe_stage("capture", time.perf_counter() - start)
             if not ret:
                 break
+            await self._stream_slots[stream_id].acquire()
+            await frame_queue.put((stream_id, frame, time.perf_counter()))
+        await frame_queue.put(None)
+
+    async def _collect_batch(self, frame_queue, sources_left):
+        """
+        从队列中凑一批帧：拿到第一帧后最多再等待max_batch_latency秒，或凑满batch_size帧需要检测的帧
+        （跳过检测的帧随批次按顺序传给追踪阶段，不占batch_size名额）
+        
+        返回:
+            (批次列表[(视频流编号, 帧, 是否检测)], 仍在读帧的视频流数量)
+        """
+        loop = asyncio.get_running_loop()
+        batch = []
+        n_detect = 0
+        deadline = None
+        while sources_left > 0 and n_detect < self.batch_size:
+            if not batch:
+                item = await frame_queue.get()
+                deadline = loop.time() + self.max_batch_latency
+            elif not frame_queue.empty():
+                item = frame_queue.get_nowait()
+            else:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(frame_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if item is None:
+                sources_left -= 1
+            else:
+                stream_id, frame, queued_at = item
+                metrics.observe_stage("frame_queue_wait", time.perf_counter() - queued_at)
+                self._stream_slots[stream_id].release()
+                detect = self._should_detect(stream_id)
+                n_detect += detect
+                batch.append((stream_id, frame, detect))
+        return batch, sources_left
+
+    async def _inference_stage(self, frame_queue, result_queue, sources_left):
+        """推理阶段：凑批后提交到推理线程池，最多inference_workers批同时进行，按顺序输出结果"""
+        loop = asyncio.get_running_loop()
+        pending = deque()
+        while sources_left > 0:
+            batch, sources_left = await self._collect_batch(frame_queue, sources_left)
+            if not batch:
+                continue
+            frames = [frame for _, frame, detect in batch if detect]
+            if frames:
+                future = loop.run_in_executor(self.inference_executor, self.detect, frames)
+            else:
+                future = loop.create_future()
+                future.set_result([])
+            pending.append((batch, future))
+            if len(pending) >= self.inference_workers:
+                batch, future = pending.popleft()
+                await result_queue.put((batch, await future))
+        while pending:
+            batch, future = pending.popleft()
+            await result_queue.put((batch, await future))
+        await result_queue.put(None)
+
+    async def _tracking_stage(self, result_queue, multi_stream=False):
+        """追踪阶段：把批量推理结果分发到各视频流的追踪器并显示结果"""
+        while True:
+            item = await result_queue.get()
+            if item is None:
+                break
+            batch, results = item
+            results = iter(results)
+            for stream_id, frame, detect in batch:
+                result = next(results) if detect else None
+                processed_frame = self.update_tracks(frame, result, stream_id)
                 
-            # 异步处理帧
-            processed_frame = await self.process_frame(frame)
+                # 输出结果：编码线程跟不上时丢帧，不阻塞追踪
+                if self.output_sink is not None:
+                    self.output_sink.submit(stream_id, processed_frame)
+                if self.display:
+                    window = f"Async Object Tracking {stream_id}" if multi_stream else "Async Object Tracking"
+                    cv2.imshow(window, processed_frame)
+            if self.display and cv2.waitKey(1) & 0xFF == ord("q"):
+                self.stop_tracking()
+                break
+        
+    def cache_detections(self, video_source, cache_dir="det_cache", overwrite=False):
+        """
+        检测缓存阶段：对视频的每一帧运行YOLO（每次batch_size帧），把检测结果写入缓存
+        
+        参数:
+            video_source: 视频文件路径
+            cache_dir: 缓存根目录，缓存按视频和模型的哈希分目录存放
+            overwrite: 为False时已有完整缓存则直接返回
             
-            # 显示结果
-            cv2.imshow("Async Object Tracking", processed_frame)
-            if cv2.waitKey(1) & 0xFF == ord("q"):
+        返回:
+            缓存目录路径，传给replay()
+        """
+        path = detection_cache.cache_path(cache_dir, video_source, self.model_path)
+        if detection_cache.is_complete(path) and not overwrite:
+            return path
+        cap = cv2.VideoCapture(video_source)
+        frame_detections = []
+        batch = []
+        while True:
+            ret, frame = cap.read()
+            if ret:
+                batch.append(frame)
+            if batch and (len(batch) == self.batch_size or not ret):
+                frame_detections.extend(self.extract_detections(result) for result in self.detect(batch))
+                batch = []
+            if not ret:
                 break
-            await asyncio.sleep(0.001)
-            # 防止阻塞
         cap.release()
-        cv2.destroyAllWindows()
+        detection_cache.write_cache(path, frame_detections, {"video": str(video_source), "model": self.model_path})
+        return path
+
+    def replay(self, cache, stream_id=0, video_source=None):
+        """
+        回放阶段：用缓存的检测结果驱动追踪，不运行YOLO
         
+        detect_interval和自适应间隔照常生效，跳过检测的帧不使用缓存中的检测结果。
+        SORT回放不需要视频帧，也不绘制；deep_sort需要用视频帧提取外观特征，必须给出video_source
+        
+        参数:
+            cache: cache_detections()返回的缓存目录，或DetectionCache对象
+            stream_id: 回放到哪一路视频流的追踪状态
+            video_source: 与缓存对应的视频，给出时逐帧读取并绘制
+            
+        生成:
+            (帧序号, 该帧的current_detections)
+        """
+        if not isinstance(cache, detection_cache.DetectionCache):
+            cache = detection_cache.DetectionCache(cache)
+        if self.tracker_choice == "deep_sort" and video_source is None:
+            raise ValueError("deep_sort回放需要video_source")
+        cap = cv2.VideoCapture(video_source) if video_source is not None else None
+        try:
+            for i in range(len(cache)):
+                frame = None
+                if cap is not None:
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                detections = cache[i] if self._should_detect(stream_id) else None
+                self.track_detections(detections, stream_id, frame)
+                yield i, self.stream(stream_id).current_detections
+        finally:
+            if cap is not None:
+                cap.release()
+
+    def reset_stream(self, stream_id=0):
+        """丢弃视频流的追踪状态，下次访问时按当前参数重新创建（参数扫描时在两次回放之间调用）"""
+        self._end_stream(stream_id)
+        self.streams.pop(stream_id, None)
+
     def stop_tracking(self):
         """停止追踪"""
         self.running = False
         
-    def get_current_detections(self):
+    def get_current_detections(self, stream_id=0):
         """获取当前检测结果"""
-        return self.current_detections
\ No newline at end of file
+        return self.stream(stream_id).current_detections
+
+    def subscribe(self, stream_id=None, kinds=("confirmed", "lost"), maxsize=10000):
+        """
+        订阅轨迹事件，返回接收事件的asyncio.Queue；不再需要时调用unsubscribe()
+
+        事件为字典 {"event", "stream_id", "object"}：
+            "confirmed": 轨迹连续出现达到stable_frames_threshold帧，每条轨迹只发一次，
+                object与get_current_detections()中的一项相同
+            "updated": 已确认的轨迹在之后每一帧的位置（连续出现中断后再次达到阈值的也只发updated），object同上
+            "lost": 已确认的轨迹结束（不再被报告或视频流结束），object为轨迹摘要：
+                id, class（整条轨迹的类别投票结果）, bbox（最后位置）, first_bbox,
+                first_frame, last_frame, first_seen, last_seen, duration(秒), age(帧数)
+
+        参数:
+            stream_id: 只接收该视频流的事件，None为所有视频流
+            kinds: 接收的事件类型
+            maxsize: 队列容量，消费者跟不上时丢弃新事件（计入dropped_total{kind="track_events"}），不阻塞追踪
+        """
+        queue = asyncio.Queue(maxsize=maxsize)
+        self._subscribers.append((queue, stream_id, frozenset(kinds)))
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers = [sub for sub in self._subscribers if sub[0] is not queue]
+
+    async def events(self, stream_id=None, kinds=("confirmed", "lost"), maxsize=10000):
+        """以异步生成器的形式逐个产生轨迹事件，参数同subscribe()"""
+        queue = self.subscribe(stream_id, kinds, maxsize)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.unsubscribe(queue)
+
+    def _emit(self, kind, stream_id, obj):
+        event = None
+        for queue, sub_stream, kinds in self._subscribers:
+            if kind not in kinds or (sub_stream is not None and sub_stream != stream_id):
+                continue
+            if event is None:
+                event = {"event": kind, "stream_id": stream_id, "object": obj}
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                metrics.DROPPED.labels("track_events").inc()
+
+    def _wants(self, kind):
+        return any(kind in kinds for _, _, kinds in self._subscribers)
+
+    def _emit_track_events(self, state, stream_id, confirmed):
+        """
+        按本帧的稳定轨迹和结束的轨迹发出事件，逐目标的工作量只与事件数量有关
+
+        confirmed: 与state.stable对应的布尔掩码，本帧首次确认的轨迹
+        """
+        for i in np.flatnonzero(confirmed):
+            self._emit("confirmed", stream_id, state.detection(i))
+        if self._wants("updated"):
+            for i in np.flatnonzero(~confirmed):
+                self._emit("updated", stream_id, state.detection(i))
+        self._emit_lost(state, stream_id, state.tracker.ended)
+
+    def _emit_lost(self, state, stream_id, ended):
+        """已稳定的轨迹结束连续出现时发出lost事件和摘要"""
+        if ended is None:
+            return
+        for i in np.flatnonzero(ended['age'] >= max(self.stable_frames_threshold, 1)):
+            first_frame = int(ended['first_frame'][i])
+            age = int(ended['age'][i])
+            first_seen = float(ended['first_seen'][i])
+            last_seen = float(ended['last_seen'][i])
+            self._emit("lost", stream_id, {
+                'id': int(ended['id'][i]),
+                'class': state.class_name(ended['cls'][i]),
+                'bbox': tuple(ended['last_box'][i].astype(np.int64).tolist()),
+                'first_bbox': tuple(ended['first_box'][i].astype(np.int64).tolist()),
+                'first_frame': first_frame,
+                'last_frame': first_frame + age - 1,
+                'first_seen': first_seen,
+                'last_seen': last_seen,
+                'duration': last_seen - first_seen,
+                'age': age,
+            })
+
+    def _end_stream(self, stream_id):
+        """视频流结束，所有轨迹视为结束"""
+        state = self.streams.get(stream_id)
+        if state is None:
+            return
+        ended = state.tracker.flush()
+        if self._subscribers:
+            self._emit_lost(state, stream_id, ended)
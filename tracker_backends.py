@@ -0,0 +1,131 @@
+'''
+模块作用：把SORT和deep_sort包装成同一个接口，Tracker不再区分追踪器类型
+    step(detections, frame, now): 用一帧(N,6)检测数组更新追踪器，返回本帧报告的轨迹
+        (boxes (N,4), ids (N,), classes (N,), streaks (N,))，streaks为每条轨迹连续被报告的帧数
+    ended: 本帧结束连续报告的轨迹摘要（数组字典，格式同sort.Sort.ended），没有时为None
+    confirm(ids): 把本帧报告的这些轨迹标记为已确认，返回其中首次确认的布尔掩码；
+        连续报告中断后又恢复的轨迹不会再次确认
+    flush(): 结束所有轨迹的连续报告（视频流结束），返回摘要
+    motion(): 每条轨迹每帧的位移相对目标尺寸的比例，用于自适应检测间隔
+
+'''
+from collections import Counter
+
+import numpy as np
+
+from sort import Sort
+
+
+class SortBackend:
+    """SORT的连续报告帧数、摘要和类别投票都在KalmanBoxBatch的数组中完成，每帧没有逐目标的Python循环"""
+
+    def __init__(self, spatial_index=False, **params):
+        self.tracker = Sort(spatial_index=spatial_index, **params)
+
+    @property
+    def ended(self):
+        return self.tracker.ended
+
+    def step(self, detections, frame=None, now=None):
+        # 跳过检测的帧只做卡尔曼预测，不计为丢失；检测框带类别列，SORT在关联时对类别投票
+        if detections is None:
+            tracks = self.tracker.coast(now)
+        else:
+            tracks = self.tracker.update(detections, now)
+        classes = tracks[:, 5] if tracks.shape[1] > 5 else np.full(len(tracks), -1.)
+        return tracks[:, :4], tracks[:, 4].astype(np.int64), classes.astype(np.int64), self.tracker.streaks
+
+    def confirm(self, ids):
+        return self.tracker.confirm(ids)
+
+    def flush(self):
+        return self.tracker.flush()
+
+    def motion(self):
+        return self.tracker.motion()
+
+
+class DeepSortBackend:
+    """deep_sort的轨迹本身是Python对象，连续报告帧数和摘要按轨迹编号记录在字典中"""
+
+    def __init__(self, **params):
+        # deep_sort带有re-ID模型，只在选择它时才导入
+        from deep_sort_realtime.deepsort_tracker import DeepSort
+        self.tracker = DeepSort(**params)
+        self.frame_index = 0
+        # 轨迹编号 -> 连续报告的帧数、开始的帧/时间/位置、最近的时间/位置、类别票数
+        self.streaks = {}
+        # 已确认的轨迹编号（与step()返回的ids相同）；连续报告结束时streaks中的记录被移除，确认状态保留到轨迹被删除
+        self.confirmed = set()
+        self.ended = None
+
+    def step(self, detections, frame=None, now=None):
+        self.frame_index += 1
+        now = self.frame_index if now is None else now
+        if detections is None:
+            # 跳过检测的帧只做卡尔曼预测：update_tracks([])会把所有轨迹标记为丢失，
+            # 删除未确认的轨迹，K>=2时轨迹永远无法确认
+            self.tracker.tracker.predict()
+            tracks = self.tracker.tracker.tracks
+        else:
+            # deep_sort需要([left, top, w, h], conf, class)元组列表
+            ltwh = detections[:, :4].copy()
+            ltwh[:, 2:] -= ltwh[:, :2]
+            detections_deepsort = [(box, conf, int(cls)) for box, conf, cls
+                                   in zip(ltwh.tolist(), detections[:, 4].tolist(), detections[:, 5].tolist())]
+            tracks = self.tracker.update_tracks(detections_deepsort, frame=frame)
+
+        boxes = np.array([track.to_ltrb() for track in tracks], dtype=float).reshape(-1, 4)
+        ids = []
+        classes = []
+        streaks = []
+        for track, box in zip(tracks, boxes):
+            streak = self.streaks.get(track.track_id)
+            if streak is None:
+                streak = self.streaks[track.track_id] = {
+                    'age': 0, 'first_frame': self.frame_index, 'first_seen': now, 'first_box': box, 'votes': Counter()}
+            streak['age'] += 1
+            streak['last_seen'] = now
+            streak['last_box'] = box
+            class_id = track.get_det_class() if hasattr(track, 'get_det_class') else None
+            if class_id is not None and class_id != -1:
+                streak['votes'][int(class_id)] += 1
+            ids.append(track.track_id)
+            classes.append(streak['votes'].most_common(1)[0][0] if streak['votes'] else -1)
+            streaks.append(streak['age'])
+        reported = set(ids)
+        self.ended = self._summarise([track_id for track_id in self.streaks if track_id not in reported])
+        if self.confirmed:
+            self.confirmed.intersection_update(int(track.track_id) for track in self.tracker.tracker.tracks)
+        return (boxes, np.array(ids, dtype=np.int64), np.array(classes, dtype=np.int64),
+                np.array(streaks, dtype=np.int64))
+
+    def _summarise(self, track_ids):
+        """移除这些轨迹的连续报告记录，返回与sort.Sort.ended相同格式的摘要"""
+        if not track_ids:
+            return None
+        streaks = [self.streaks.pop(track_id) for track_id in track_ids]
+        return {
+            'id': np.array(track_ids),
+            'age': np.array([s['age'] for s in streaks]),
+            'first_frame': np.array([s['first_frame'] for s in streaks]),
+            'first_seen': np.array([s['first_seen'] for s in streaks], dtype=float),
+            'last_seen': np.array([s['last_seen'] for s in streaks], dtype=float),
+            'first_box': np.array([s['first_box'] for s in streaks]).reshape(-1, 4),
+            'last_box': np.array([s['last_box'] for s in streaks]).reshape(-1, 4),
+            'cls': np.array([s['votes'].most_common(1)[0][0] if s['votes'] else -1 for s in streaks]),
+        }
+
+    def confirm(self, ids):
+        new = np.array([track_id not in self.confirmed for track_id in ids.tolist()], dtype=bool)
+        self.confirmed.update(ids.tolist())
+        return new
+
+    def flush(self):
+        self.ended = self._summarise(list(self.streaks))
+        return self.ended
+
+    def motion(self):
+        # deep_sort的状态为[x, y, a, h, vx, vy, va, vh]
+        means = np.array([track.mean for track in self.tracker.tracker.tracks]).reshape(-1, 8)
+        return np.hypot(means[:, 4], means[:, 5]) / means[:, 3]
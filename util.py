@@ -29,6 +29,57 @@ def load_config(config_path='config.yaml'):
     except yaml.YAMLError as e:
         raise ValueError(f"YAML解析错误: {e}")
     
+def load_streams(config_path='config.yaml'):
+    """
+    从YAML配置文件中读取视频源列表
+    
+    参数:
+        config_path (str): 配置文件路径，默认为'config.yaml'
+    
+    返回:
+        list: 每路视频流一个字典 {"id", "source", "client_id", "fps"}；
+            配置中没有streams时只有一路视频流 traffic.avi；
+            多路视频流时未单独配置client_id的使用"{client_id}/{视频流编号}"，只有一路时沿用client_id
+    """
+    with open(config_path, 'r') as file:
+        config = yaml.safe_load(file)
+    client_id = config.get('client_id')
+    streams = []
+    configured = config.get('streams') or [{'id': 0, 'source': 'traffic.avi'}]
+    for stream in configured:
+        if 'source' not in stream:
+            raise ValueError("视频流配置缺少source")
+        stream_id = stream.get('id', len(streams))
+        streams.append({
+            'id': stream_id,
+            'source': stream['source'],
+            'client_id': stream.get('client_id') or (client_id if len(configured) == 1 else f"{client_id}/{stream_id}"),
+            'fps': stream.get('fps'),
+        })
+    if len({stream['id'] for stream in streams}) != len(streams):
+        raise ValueError("视频流编号重复")
+    return streams
+
+def load_profile(config_path='config.yaml'):
+    """
+    从YAML配置文件中读取性能剖析设置
+    
+    参数:
+        config_path (str): 配置文件路径，默认为'config.yaml'
+    
+    返回:
+        dict: {"on_start", "seconds", "mode", "dir"}，配置中没有profile时使用默认值
+    """
+    with open(config_path, 'r') as file:
+        config = yaml.safe_load(file)
+    profile = config.get('profile') or {}
+    return {
+        'on_start': bool(profile.get('on_start', False)),
+        'seconds': profile.get('seconds', 30),
+        'mode': profile.get('mode', 'sample'),
+        'dir': profile.get('dir', 'profiles'),
+    }
+    
 def convert_numpy_types(obj):
     if isinstance(obj, dict):
         return {k: convert_numpy_types(v) for k, v in obj.items()}